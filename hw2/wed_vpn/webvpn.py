@@ -11,14 +11,278 @@ from bs4 import BeautifulSoup as BS
 import json
 from selenium import webdriver
 import re
+import os
+import time
+import shutil
+import tempfile
+import queue
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from lxml import html as lxml_html
+
+semester_pattern = re.compile(r'\d{4}-\d{4}-\d')
+table_class = "table table-striped  table-condensed"
+# The sites a grades check leaves storage on: WebVPN proxies info and the grades pages under its own origin
+visited_origins = ("https://webvpn.tsinghua.edu.cn", "https://id.tsinghua.edu.cn",
+                   "http://info.tsinghua.edu.cn", "https://info.tsinghua.edu.cn")
+
+
+SemesterGrade = namedtuple("SemesterGrade", ["semester", "credits", "gpa", "courses"])
+
+
+def semester_of(info):
+    """
+    :param info: the cell texts of a course row
+    :return: the semester, e.g. "2021-2022-1", from the 8th cell, or the 9th or 10th if the 8th is not one
+    """
+    if semester_pattern.match(info[7]):
+        return info[7]
+    if semester_pattern.match(info[8]):
+        return info[8]
+    return info[9]
+
+
+def semester_gpa(rows):
+    """
+    Calculate the credit-weighted GPA of each semester in one pass over arrays
+
+    :param rows: the cell texts of each course row in the grades table
+    :return: list of `SemesterGrade`, in the order the semesters appear in the table
+    """
+    semesters = [semester_of(info) for info in rows]
+    order = {semester: i for i, semester in enumerate(dict.fromkeys(semesters))}
+    index = np.fromiter((order[semester] for semester in semesters), dtype=np.intp, count=len(semesters))
+    credits = np.array([int(info[2]) for info in rows], dtype=float)
+    points = np.array([float(info[5]) for info in rows], dtype=float)
+    credit_sum = np.bincount(index, weights=credits, minlength=len(order))
+    score_sum = np.bincount(index, weights=credits * points, minlength=len(order))
+    gpa = np.divide(score_sum, credit_sum, out=np.full(len(order), np.nan), where=credit_sum > 0)
+    courses = np.bincount(index, minlength=len(order))
+    return [
+        SemesterGrade(semester, int(credit_sum[i]), float(gpa[i]), int(courses[i]))
+        for semester, i in order.items()
+    ]
+
+
+def print_gpa(grades):
+    for grade in grades:
+        key = grade.semester
+        sem = ""
+        if key[-1]=='1':
+            sem = key[:4]+"秋: "
+        elif key[-1]=='2':
+            sem = key[5:9]+"春: "
+        elif key[-1]=='3':
+            sem = key[5:9]+"夏: "
+
+        print(sem, grade.gpa)
+
+
+def grade_rows(table):
+    """
+    Read the course rows of the grades table, skipping its header and its last row
+
+    :param table: the table element, parsed by lxml
+    :return: the cell texts of each course row
+    """
+    courses = table.xpath("./tbody/tr | ./tr")  # The browser adds <tbody>, the raw page may not have it
+    return [
+        [cell.text_content().strip() for cell in tr.xpath('./td/div[@align="center"]')]
+        for tr in courses[1:len(courses) - 1]
+    ]
+
+
+def find_grade_table(page):
+    """
+    :param page: the grades page
+    :return: the grades table element, or None if the page has none, e.g. a login page
+    """
+    if not page.strip():
+        return None
+    tables = lxml_html.fromstring(page).xpath(f'//table[@class="{table_class}"]')
+    return tables[0] if tables else None
+
+
+# Guards the read-modify-write of the cache files, shared by the `SessionCache` of every account
+_session_lock = threading.Lock()
+
+
+class SessionCache:
+    def __init__(self, path=".webvpn_session.json", max_age=6 * 3600):
+        """
+        Saved WebVPN cookies and the grades page URL of each account, so that later runs
+        can read the grades over plain HTTP without a browser
+
+        :param path: the cache file, readable only by its owner since the cookies log in as the account
+        :param max_age: seconds after which a saved session is not tried
+        """
+        self.path = path
+        self.max_age = max_age
+
+    def _read(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf8") as f:
+            return json.load(f)
+
+    def _write(self, sessions):
+        # A temporary file of its own in the same directory, created with mode 0600
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".",
+                                   dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, "w", encoding="utf8") as f:
+                json.dump(sessions, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def load(self, userid):
+        """
+        :return: {"cookies", "grades_url", "saved"} of the account, or None if missing or too old
+        """
+        with _session_lock:
+            session = self._read().get(str(userid))
+        if session is None or time.time() - session["saved"] > self.max_age:
+            return None
+        return session
+
+    def save(self, userid, cookies, grades_url):
+        with _session_lock:
+            sessions = self._read()
+            sessions[str(userid)] = {"cookies": cookies, "grades_url": grades_url, "saved": time.time()}
+            self._write(sessions)
+
+    def drop(self, userid):
+        with _session_lock:
+            sessions = self._read()
+            if sessions.pop(str(userid), None) is not None:
+                self._write(sessions)
+
+
+_driver_lock = threading.Lock()
+
+
+def driver_path(cache=".chromedriver.json"):
+    """
+    The chromedriver binary, downloaded by webdriver_manager only the first time.
+    Later calls read its path from `cache` without touching the network.
+
+    :param cache: the file keeping the path
+    :return: path of the binary
+    """
+    with _driver_lock:
+        if os.path.exists(cache):
+            with open(cache, "r", encoding="utf8") as f:
+                path = json.load(f)["path"]
+            if os.path.exists(path):
+                return path
+        path = ChromeDriverManager().install()
+        with open(cache, "w", encoding="utf8") as f:
+            json.dump({"path": path}, f)
+        return path
+
+
+def new_driver(headless=True, profile=None) -> wd:
+    """
+    Launch Chrome
+
+    :param headless: run without a window
+    :param profile: the user data directory, a fresh one of Chrome's own if None
+    :return: the driver
+    """
+    options=webdriver.ChromeOptions()
+    options.add_argument('blink-settings=imagesEnabled=false')
+    if headless:
+        options.add_argument('--headless')
+    if profile is not None:
+        options.add_argument(f'--user-data-dir={profile}')
+    return selenium.webdriver.Chrome(service=ChromeService(driver_path()),options=options)
+
+
+class BrowserPool:
+    def __init__(self, size, headless=True):
+        """
+        Chrome instances launched ahead, each with its own profile directory, to be checked out
+        by one account at a time and reset between accounts
+
+        :param size: the number of browsers, launched in parallel
+        :param headless: run without windows
+        """
+        self.headless = headless
+        self.profiles = [tempfile.mkdtemp(prefix="webvpn-") for _ in range(size)]
+        with ThreadPoolExecutor(size) as executor:
+            launching = [executor.submit(new_driver, headless, profile) for profile in self.profiles]
+        self.drivers = [f.result() for f in launching if f.exception() is None]
+        if len(self.drivers) < size:  # Do not leak the browsers that did start, nor the profiles
+            self.close()
+            raise next(f.exception() for f in launching if f.exception() is not None)
+        self.idle = queue.Queue()
+        for d in self.drivers:
+            self.idle.put(d)
+
+    @contextmanager
+    def checkout(self):
+        """
+        Take an idle browser, waiting for one if all are in use
+
+        """
+        d = self.idle.get()
+        try:
+            yield d
+        finally:
+            try:
+                self.reset(d)
+            except Exception:  # The browser is broken, e.g. by a failed account; replace it to keep the pool's size
+                i = self.drivers.index(d)
+                try:
+                    d.quit()
+                except Exception:
+                    pass
+                d = self.drivers[i] = new_driver(self.headless, self.profiles[i])
+            self.idle.put(d)
+
+    @staticmethod
+    def reset(d: wd):
+        """
+        Leave one blank window and clear the cookies, and the storage and cache of `visited_origins`,
+        left by the last account
+
+        """
+        for window_handle in d.window_handles[1:]:
+            d.switch_to.window(window_handle)
+            d.close()
+        d.switch_to.window(d.window_handles[0])
+        d.get("about:blank")
+        d.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origin in visited_origins:  # The command takes one concrete origin at a time
+            d.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+    def close(self):
+        for d in self.drivers:
+            d.quit()
+        for profile in self.profiles:
+            shutil.rmtree(profile, ignore_errors=True)
+
 
 class WebVPN:
-    def __init__(self, opt: dict, headless=False):
+    def __init__(self, opt: dict, headless=True, driver: wd = None):
+        """
+        :param opt: the account, with "username" and "password"
+        :param headless: run the browser without a window
+        :param driver: a browser to use, e.g. from `BrowserPool.checkout`; one is launched if None
+        """
         self.root_handle = None
-        self.driver: wd = None
+        self.driver: wd = driver
         self.passwd = opt["password"]
         self.userid = opt["username"]
         self.headless = headless
+        self.cache = SessionCache(opt.get("session_cache", ".webvpn_session.json"),
+                                  opt.get("session_max_age", 6 * 3600))
 
     def login_webvpn(self):
         """
@@ -27,14 +291,9 @@ class WebVPN:
         :return:
         """
 
-        options=webdriver.ChromeOptions()
-        options.add_argument('blink-settings=imagesEnabled=false')
-        options.add_argument('--headless')
-
         d = self.driver
-        if d is not None:
-            d.close()
-        d = selenium.webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()),options=options)
+        if d is None:
+            d = new_driver(self.headless)
         d.get("https://webvpn.tsinghua.edu.cn/login")
         username = d.find_elements(By.XPATH,
                                    '//div[@class="login-form-item"]//input'
@@ -150,6 +409,36 @@ class WebVPN:
         #       - Before return, make sure that you have logged in successfully
         
 
+    def save_session(self):
+        """
+        Save the cookies of the browser and the URL of the grades page it shows, after `login_info`
+
+        :return:
+        """
+        self.cache.save(self.userid, self.driver.get_cookies(), self.driver.current_url)
+
+    def get_grades_http(self):
+        """
+        Get the GPA of each semester over plain HTTP with the saved session, without a browser
+
+        :return: list of `SemesterGrade`, or None if there is no usable saved session
+        """
+        session = self.cache.load(self.userid)
+        if session is None:
+            return None
+        http = requests.Session()
+        for cookie in session["cookies"]:
+            http.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+        try:
+            res = http.get(session["grades_url"], timeout=10)
+        except requests.RequestException:
+            return None
+        table = find_grade_table(res.content) if res.status_code == 200 else None
+        if table is None:  # Redirected to the login page, the session expired
+            self.cache.drop(self.userid)
+            return None
+        return semester_gpa(grade_rows(table))
+
     def get_grades(self):
         """
         TODO: Get and calculate the GPA for each semester.
@@ -161,52 +450,15 @@ class WebVPN:
             2021-秋: *.**
             2022-春: *.**
 
-        :return:
+        :return: list of `SemesterGrade`: semester, credits, GPA and number of courses
         """
         d=self.driver
-        table_path = '//table[@class="table table-striped  table-condensed"]'
+        table_path = f'//table[@class="{table_class}"]'
         tables = d.find_elements(By.XPATH,table_path)
-        table = tables[0]
-        courses = table.find_elements(By.XPATH, "./tbody/tr")
-        n = len(courses)-2
-        semester=""
-        semester_pattern=re.compile('\d{4}-\d{4}-\d')
-        gpa={}
-        credits=0
-        total_score=0
-
-        for i in range(1,n+1):
-            info = courses[i].find_elements(By.XPATH,'./td/div[@align="center"]')
-            
-            semester_i = info[7].text
-            if not semester_pattern.match(info[7].text):
-                if semester_pattern.match(info[8].text):
-                    semester_i = info[8].text
-                else:
-                    semester_i=info[9].text
-            if semester != semester_i:
-                if semester:
-                    gpa[semester] = total_score / credits
-                semester = semester_i
-                credits=0
-                total_score=0
-            
-            credits += int(info[2].text)
-            total_score += float(info[5].text) * int(info[2].text)
-
-            if(i==n):
-                gpa[semester] = total_score / credits
-
-        for key in gpa:
-            sem = ""
-            if key[-1]=='1':
-                sem = key[:4]+"秋: "
-            elif key[-1]=='2':
-                sem = key[5:9]+"春: "
-            elif key[-1]=='3':
-                sem = key[5:9]+"夏: "
-
-            print(sem, gpa[key])
+        # One round trip for the whole table, instead of one per row and cell
+        inner = tables[0].get_attribute("innerHTML")
+        table = lxml_html.fragment_fromstring(f"<table>{inner}</table>")
+        return semester_gpa(grade_rows(table))
 
         # Hint: - You can directly switch into
         #         `zhjw.cic.tsinghua.edu.cn/cj.cjCjbAll.do?m=bks_cjdcx&cjdlx=zw`
@@ -217,13 +469,87 @@ class WebVPN:
         #         HTML code
 
 
+def grades_in_browser(w: WebVPN):
+    """
+    Log in and get the grades in the browser, then save the session for the next runs
+
+    :return: list of `SemesterGrade`
+    """
+    w.login_webvpn()
+    w.access("http://info.tsinghua.edu.cn")
+    w.switch_another()
+    w.login_info()
+    grades = w.get_grades()
+    w.save_session()  # After the grades page is loaded
+    return grades
+
+
+def check_grades(w: WebVPN):
+    """
+    Get the grades of an account, over HTTP with its saved session if possible, otherwise in the browser
+
+    :return: list of `SemesterGrade`
+    """
+    grades = w.get_grades_http()
+    if grades is None:
+        print('*'*20,'\n',"Checking your gpa, it can take a while...",'\n','*'*20)
+        grades = grades_in_browser(w)
+    print_gpa(grades)
+    return grades
+
+
+def check_accounts(accounts, size=None, headless=True):
+    """
+    Get the grades of several accounts at once. The accounts without a usable saved session
+    share a pool of browsers. An account that fails does not stop the others.
+    The results are printed with the account they belong to once all are collected
+
+    :param accounts: the accounts, each like settings.json
+    :param size: the number of browsers, by default one per account up to the number of cores
+    :return: list of the grades of each account, or the exception it failed with
+    """
+    clients = [WebVPN(opt, headless) for opt in accounts]
+
+    def attempt(func, w):
+        try:
+            return func(w)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(len(clients) or 1) as executor:
+        results = list(executor.map(lambda w: attempt(WebVPN.get_grades_http, w), clients))
+    cold = [i for i, grades in enumerate(results) if grades is None]
+    if cold:
+        print(f"Checking {len(cold)} account(s) in browsers, it can take a while...")
+        size = size or min(len(cold), os.cpu_count() or 1)
+        pool = BrowserPool(size, headless)
+
+        def check(w):
+            with pool.checkout() as d:
+                w.driver = d
+                return grades_in_browser(w)
+
+        try:
+            with ThreadPoolExecutor(size) as executor:
+                for i, grades in zip(cold, executor.map(lambda w: attempt(check, w), [clients[i] for i in cold])):
+                    results[i] = grades
+        finally:
+            pool.close()
+
+    for w, grades in zip(clients, results):
+        print('*'*20, w.userid, '*'*20)
+        if isinstance(grades, Exception):
+            print(f"Failed: {grades!r}")
+        else:
+            print_gpa(grades)
+    return results
+
+
 if __name__ == "__main__":
     with open("settings.json","r") as f:
-        w=WebVPN(json.load(f))
-        w.login_webvpn()
-        print('*'*20,'\n',"Checking your gpa, it can take a while...",'\n','*'*20)
-        w.access("http://info.tsinghua.edu.cn")
-        w.switch_another()
-        w.login_info()
-        w.get_grades()
+        settings = json.load(f)
+    if isinstance(settings, list):  # Several accounts
+        check_accounts(settings)
+    else:
+        check_grades(WebVPN(settings))
     
\ No newline at end of file
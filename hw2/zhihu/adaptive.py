@@ -0,0 +1,76 @@
+from storage import parse_heat
+
+
+class AdaptiveScheduler:
+    def __init__(self, interval, min_interval, max_interval, target_churn, heat_threshold, smoothing=0.5):
+        """
+        Adapt the interval between board crawls to how fast the board changes, and pick the entries
+        whose detail is worth refreshing
+
+        :param interval: the initial interval in seconds
+        :param min_interval: the shortest interval
+        :param max_interval: the longest interval
+        :param target_churn: the churn at which the interval stays the same
+        :param heat_threshold: relative heat change since the last refresh that makes an entry refreshed
+        :param smoothing: weight of the new interval against the old one, in (0, 1]
+        """
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_churn = target_churn
+        self.heat_threshold = heat_threshold
+        self.smoothing = smoothing
+        self.previous = {}  # qid -> (ranking, heat) in the last snapshot
+        self.refreshed_heat = {}  # qid -> heat when its detail was last refreshed
+        self.refresh = set()  # qids to refresh in the current crawl
+        self.metrics = {}
+
+    def observe(self, board_entries) -> dict:
+        """
+        Compare a board snapshot with the previous one, then update the interval and the entries to refresh
+
+        :param board_entries: the entries from `get_board`
+        :return: the decision metrics: new qids ratio, mean rank movement, mean relative heat change,
+                 the churn combining them, the next interval and the number of entries to refresh
+        """
+        current = {item["qid"]: (idx, parse_heat(item["heat"])) for idx, item in enumerate(board_entries)}
+        common = [qid for qid in current if qid in self.previous]
+        new_ratio = 1 - len(common) / len(current) if current else 0
+        rank_move = sum(abs(current[q][0] - self.previous[q][0]) for q in common) / len(common) if common else 0
+        heat_deltas = [
+            abs(current[q][1] - self.previous[q][1]) / self.previous[q][1]
+            for q in common if current[q][1] is not None and self.previous[q][1]
+        ]
+        heat_change = sum(heat_deltas) / len(heat_deltas) if heat_deltas else 0
+        # Rank movement is scaled by the board size, so the three parts are all ratios
+        churn = new_ratio + rank_move / max(len(current), 1) + heat_change
+
+        if self.previous:
+            wanted = self.interval * self.target_churn / max(churn, 1e-6)
+            wanted = min(self.max_interval, max(self.min_interval, wanted))
+            self.interval = self.smoothing * wanted + (1 - self.smoothing) * self.interval
+        self.previous = current
+
+        self.refresh = set()
+        for qid, (_, heat) in current.items():
+            last = self.refreshed_heat.get(qid)
+            if last is None or heat is None or not last or abs(heat - last) / last > self.heat_threshold:
+                self.refresh.add(qid)
+                self.refreshed_heat[qid] = heat
+        for qid in list(self.refreshed_heat):  # Forget the questions that left the board
+            if qid not in current:
+                del self.refreshed_heat[qid]
+
+        self.metrics = {
+            "new_ratio": new_ratio,
+            "rank_move": rank_move,
+            "heat_change": heat_change,
+            "churn": churn,
+            "interval": self.interval,
+            "refresh": len(self.refresh),
+            "entries": len(current),
+        }
+        return self.metrics
+
+    def needs_refresh(self, qid) -> bool:
+        return qid in self.refresh
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import signal
+import time
+from collections import namedtuple
+import aiohttp
+import metrics
+from logs import setup_logging
+from storage import record_row
+from zhihu import ZhihuCrawler
+
+logger = logging.getLogger()
+
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+class Page(namedtuple("Page", ["status_code", "headers", "content"])):
+    """
+    A read response, with the attributes of `requests.Response` used by the parsers
+    """
+
+    @property
+    def text(self):
+        return self.content.decode("utf8", "replace")
+
+
+class AsyncZhihuCrawler(ZhihuCrawler):
+    """
+    The crawler on one asyncio event loop. Requests are made with aiohttp, at most `question_workers`
+    at a time; storage calls run in worker threads, since the database drivers are blocking.
+    """
+
+    def make_session(self):
+        return None  # An aiohttp session belongs to a running loop, it is opened by `run`
+
+    async def open(self):
+        config = self.settings["config"]
+        self.session = aiohttp.ClientSession(
+            headers=self.settings["headers"],
+            connector=aiohttp.TCPConnector(limit=config.get("http_pool_size", 8)),
+            timeout=aiohttp.ClientTimeout(total=config.get("http_timeout", 10)),
+        )
+        self.semaphore = asyncio.Semaphore(max(1, config.get("question_workers", 1)))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        await asyncio.to_thread(self.storage.close)
+
+    async def fetch(self, url, headers=None) -> Page:
+        """
+        GET a page, retrying with backoff on 429, 5xx and connection errors like `make_session`
+
+        :param url: the page URL
+        :param headers: extra headers of this request, e.g. validators of a conditional request
+        :return: the page
+        :raise RuntimeError: with the page as its argument, if the status code is not 200,
+                             or 304 for a conditional request
+        """
+        config = self.settings["config"]
+        retries = config.get("http_retries", 3)
+        for attempt in range(retries + 1):
+            begin = time.perf_counter()
+            try:
+                async with self.session.get(url, headers=headers) as res:
+                    page = Page(res.status, res.headers, await res.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == retries:
+                    raise
+            else:
+                seconds = time.perf_counter() - begin
+                self.stats.record(url, page.status_code, seconds, len(page.content))
+                metrics.stage_seconds.observe(seconds, stage="fetch")
+                metrics.requests_total.inc(status=page.status_code)
+                if page.status_code not in retry_statuses or attempt == retries:
+                    break
+            await asyncio.sleep(config.get("http_backoff", 1) * 2 ** attempt)
+        if page.status_code != 200 and not (headers and page.status_code == 304):
+            raise RuntimeError(page)
+        return page
+
+    async def acquire(self):
+        while True:
+            wait = self.limiter.reserve()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def db(self, func, *args):
+        """
+        Run a blocking storage call in a worker thread
+
+        :param func: e.g. `ZhihuCrawler.end_crawl` bound to this crawler
+        :return: func(*args)
+        """
+        return await asyncio.to_thread(func, *args)
+
+    async def get_board(self) -> list:
+        url = self.settings["config"].get("base_url", "https://www.zhihu.com") + "/hot"
+        page = await self.fetch(url)
+        with metrics.stage_seconds.time(stage="parse"):
+            return self.parse_board(page.text)
+
+    async def get_question(self, qid, validators=None) -> dict:
+        qid = str(qid)
+        url = self.settings["config"].get("base_url", "https://www.zhihu.com") + "/question/" + qid
+        page = await self.fetch(url, validators)
+        if page.status_code == 304:
+            return None
+        with metrics.stage_seconds.time(stage="parse"):
+            question = self.parse_question(page.content, qid)
+        return self.question_info(question, page.headers)
+
+    async def refresh_question(self, qid) -> dict:
+        qid = str(qid)
+        cached = self.detail_cache.get(qid)
+        detail = self.compare_detail(cached, await self.get_question(qid, cached["validators"] if cached else None))
+        if detail["raw"] is not None:
+            await self.db(self.storage.add_detail, detail["detail_hash"], qid, detail["hit_at"], detail["raw"])
+        self.detail_cache[qid] = dict(detail, raw=None)
+        return detail
+
+    async def question_detail(self, qid) -> dict:
+        if self.settings["config"].get("incremental", False):
+            return await self.refresh_question(qid)
+        detail = await self.get_question(qid)
+        if self.scheduler is not None:  # `raw` included, as in `ZhihuCrawler.question_detail`
+            self.detail_cache[str(qid)] = dict(detail)
+        return detail
+
+    async def fetch_detail(self, crawl_id, idx, item) -> dict:
+        """
+        Fetch the detail of a board entry like `ZhihuCrawler.fetch_detail`, within the concurrency bound
+        """
+        detail = self.empty_detail()
+        if item["qid"] is None:
+            logger.warning(f"Unparsed URL @ {item['url']} ranking {idx} in crawl {crawl_id}.")
+            return detail
+        cached = self.cached_detail(item)
+        if cached is not None:
+            return cached
+        async with self.semaphore:
+            with metrics.stage_seconds.time(stage="sleep"):
+                await self.acquire()
+            try:
+                detail = await self.question_detail(item["qid"])
+            except Exception as e:
+                if len(e.args) > 0 and isinstance(e.args[0], Page):
+                    logger.exception(f"{e}; {e.args[0].status_code}; {e.args[0].text}")
+                else:
+                    logger.exception(f"{str(e)}")
+            else:
+                logger.info(f"Get question detail for {item['title']}: raw detail length {len(detail['raw']) if detail['raw'] else 0}",
+                            extra={"sample": True})
+        return detail
+
+    async def crawl(self, top=None):
+        """
+        Crawl the board and the questions on it once. The records are written with the ending time
+        in one transaction; if the crawl is cancelled at any point after it began, the finished ones
+        are written and the crawl is closed
+
+        :param top: only look at the first `top` entries in the board
+        :return: Crawl ID, or None if the crawl stopped on an exception
+        """
+        logger.info("Begin crawling ...")
+        crawl_id = None
+        begin = time.perf_counter()
+        before = metrics.registry.snapshot()
+        try:
+            beginning = asyncio.ensure_future(self.db(self.begin_crawl, time.time()))
+            try:
+                crawl_id = await asyncio.shield(beginning)
+            except asyncio.CancelledError:
+                # The row is inserted by the thread anyway, so wait for its ID to close it
+                await asyncio.shield(self.db(self.end_crawl, await beginning))
+                raise
+            board_entries, tasks = [], []
+            try:
+                board_entries = await self.get_board()
+                logger.info(f"Get {len(board_entries)} items")
+                if top:
+                    board_entries = board_entries[:top]
+                if self.scheduler is not None:
+                    churn = self.scheduler.observe(board_entries)
+                    logger.info(f"Crawl {crawl_id} churn {churn['churn']:.3f}, refresh {churn['refresh']}/{churn['entries']}, "
+                                f"next interval {churn['interval']:.0f} s")
+
+                tasks = [asyncio.create_task(self.fetch_detail(crawl_id, idx, item))
+                         for idx, item in enumerate(board_entries)]
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                rows = [
+                    record_row(crawl_id, idx, item, task.result())
+                    for idx, (item, task) in enumerate(zip(board_entries, tasks))
+                    if task.done() and not task.cancelled() and task.exception() is None
+                ]
+                # Shielded so that the crawl is closed even when it is cancelled
+                await asyncio.shield(self.db(self.end_crawl, crawl_id, rows))
+            stats = self.stats.summary()
+            logger.info(
+                f"Crawl {crawl_id} made {stats['requests']} requests, {stats['bytes'] / 1024:.1f} KB, "
+                f"{stats['seconds']:.2f} s in total, {stats['mean_seconds']:.3f} s mean, {stats['max_seconds']:.3f} s max")
+        except Exception as e:
+            logger.exception(f"Crawl {crawl_id} encountered an exception {e}. This crawl stopped.")
+            metrics.crawls_total.inc(result="failed")
+            return None
+        metrics.crawls_total.inc(result="ok")
+        metrics.crawl_seconds.observe(time.perf_counter() - begin)
+        if self.settings["config"].get("metrics_summary", False):
+            await self.db(self.add_metrics, crawl_id, before)
+        return crawl_id
+
+    async def run(self, top=None):
+        """
+        The crawling flow on the event loop, until cancelled. SIGTERM cancels it like Ctrl-C
+
+        :param top: only look at the first `top` entries in the board
+        """
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await self.open()
+        try:
+            await self.db(self.create_table)
+            port = self.settings["config"].get("metrics_port")
+            if port:
+                metrics.serve(port)
+            while True:
+                begin_time = time.time()
+                await self.crawl(top)
+                interval = self.scheduler.interval if self.scheduler is not None \
+                    else self.settings["config"]["interval_between_board"]
+                _t = max(0, begin_time + interval - time.time())
+                logger.info(f"Sleep {_t} second(s)")
+                await asyncio.sleep(_t)
+        finally:
+            await self.close()
+
+    def watch(self, top=None):
+        """
+        The crawling flow, as `ZhihuCrawler.watch`
+
+        :param top: only look at the first `top` entries in the board
+        """
+        try:
+            asyncio.run(self.run(top))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            logger.info("Stopped")
+
+
+if __name__ == "__main__":
+    z = AsyncZhihuCrawler()
+    setup_logging(z.settings.get("logging"))
+    z.watch()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import logging
+import os
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from storage import make_storage
+
+logger = logging.getLogger()
+
+# The exported tables: name -> (source table, schema). `record_raw` holds `raw` of `record` apart,
+# row by row in the same order, so the cheap columns can be read without it.
+tables = {
+    "crawl": ("crawl", pa.schema([
+        ("id", pa.int64()),
+        ("begin", pa.float64()),
+        ("end", pa.float64()),
+    ])),
+    "record": ("record", pa.schema([
+        ("id", pa.int64()),
+        ("qid", pa.int64()),
+        ("crawl_id", pa.int64()),
+        ("hit_at", pa.float64()),
+        ("ranking", pa.int32()),
+        ("title", pa.string()),
+        ("heat", pa.string()),
+        ("heat_value", pa.int64()),
+        ("created", pa.int64()),
+        ("visitCount", pa.int64()),
+        ("followerCount", pa.int64()),
+        ("answerCount", pa.int64()),
+        ("excerpt", pa.string()),
+        ("url", pa.string()),
+        ("detail_hash", pa.string()),
+    ])),
+    "record_raw": ("record", pa.schema([
+        ("id", pa.int64()),
+        ("raw", pa.string()),
+    ])),
+    "question_detail": ("question_detail", pa.schema([
+        ("hash", pa.string()),
+        ("qid", pa.int64()),
+        ("first_seen", pa.float64()),
+        ("raw", pa.string()),
+    ])),
+}
+keys = {"crawl": "id", "record": "id", "question_detail": "hash"}
+extensions = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def select_chunks(storage, table, columns, chunk_size):
+    """
+    Read a table in chunks, paging on its key so only one chunk is held in memory
+
+    :param storage: the storage backend
+    :param table: table name
+    :param columns: the columns to read, including the key
+    :param chunk_size: rows per chunk
+    :return: an iterator of row lists
+    """
+    key = keys[table]
+    names = ", ".join(f"`{c}`" for c in columns)
+    last = None
+    while True:
+        where = "" if last is None else f"WHERE `{key}` > {storage.placeholder}"
+        sql = f"SELECT {names} FROM `{table}` {where} ORDER BY `{key}` LIMIT {int(chunk_size)};"
+        rows = storage.query(sql, None if last is None else (last,), lambda x: x.fetchall())
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][key]
+
+
+class Writer:
+    def __init__(self, path, schema, fmt):
+        """
+        Write record batches to a Parquet or Arrow IPC file
+
+        :param path: the file to write
+        :param schema: the schema of the batches
+        :param fmt: "parquet" or "arrow"
+        """
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(path, schema, compression="zstd")
+        else:
+            self._writer = ipc.new_file(path, schema)
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+
+
+def export(storage, directory, fmt="parquet", chunk_size=10000):
+    """
+    Export the crawl history to one file per table in `tables`
+
+    :param storage: the storage backend
+    :param directory: where to write the files
+    :param fmt: "parquet" or "arrow"
+    :param chunk_size: rows per chunk, which bounds the memory used
+    :return: dict of table name -> rows exported
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = lambda name: os.path.join(directory, name + extensions[fmt])
+    counts = {}
+    for name in ("crawl", "question_detail"):
+        table, schema = tables[name]
+        writer = Writer(path(name), schema, fmt)
+        counts[name] = 0
+        for rows in select_chunks(storage, table, schema.names, chunk_size):
+            writer.write(to_batch(rows, schema))
+            counts[name] += len(rows)
+        writer.close()
+
+    # `record` and `record_raw` come from the same chunks, so their batches line up
+    schema, raw_schema = tables["record"][1], tables["record_raw"][1]
+    writer, raw_writer = Writer(path("record"), schema, fmt), Writer(path("record_raw"), raw_schema, fmt)
+    counts["record"] = 0
+    for rows in select_chunks(storage, "record", schema.names + ["raw"], chunk_size):
+        writer.write(to_batch(rows, schema))
+        raw_writer.write(to_batch(rows, raw_schema))
+        counts["record"] += len(rows)
+        logger.info(f"Exported {counts['record']} records")
+    writer.close()
+    raw_writer.close()
+    return counts
+
+
+def to_batch(rows, schema) -> pa.RecordBatch:
+    return pa.record_batch([[row[c] for row in rows] for c in schema.names], schema=schema)
+
+
+def read_batches(path, fmt, chunk_size):
+    """
+    :return: an iterator of the record batches in a file. Arrow IPC files are memory-mapped
+    """
+    if fmt == "parquet":
+        yield from pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+        return
+    with pa.memory_map(path) as source:
+        reader = ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def insert_batches(storage, table, batches):
+    """
+    Insert record batches with one `executemany` per batch, each in its own transaction
+
+    :param storage: the storage backend
+    :param table: table name
+    :param batches: an iterator of record batches whose columns are named after the table
+    :return: rows inserted
+    """
+    count = 0
+    for batch in batches:
+        names = batch.schema.names
+        sql = f"INSERT INTO `{table}` ({', '.join(f'`{c}`' for c in names)}) " \
+              f"VALUES ({', '.join([storage.placeholder] * len(names))});"
+        rows = list(zip(*(column.to_pylist() for column in batch.columns)))
+        with storage.transaction() as (conn, cur):
+            cur.executemany(sql, rows)
+            conn.commit()
+        count += len(rows)
+    return count
+
+
+def load(storage, directory, fmt="parquet", chunk_size=10000):
+    """
+    Load files written by `export` back into the storage, keeping their IDs.
+    The target tables should not hold rows with the same IDs.
+
+    :param storage: the storage backend
+    :param directory: where the files are
+    :param fmt: "parquet" or "arrow"
+    :param chunk_size: rows per batch when reading Parquet
+    :return: dict of table name -> rows loaded
+    """
+    path = lambda name: os.path.join(directory, name + extensions[fmt])
+    storage.create_table()
+    counts = {}
+    for name in ("crawl", "question_detail"):
+        counts[name] = insert_batches(storage, name, read_batches(path(name), fmt, chunk_size))
+
+    def records():
+        raws = read_batches(path("record_raw"), fmt, chunk_size)
+        for batch, raw in zip(read_batches(path("record"), fmt, chunk_size), raws):
+            if not batch.column("id").equals(raw.column("id")):
+                raise ValueError("record and record_raw are not aligned")
+            yield pa.RecordBatch.from_arrays(
+                batch.columns + [raw.column("raw")], names=batch.schema.names + ["raw"])
+
+    counts["record"] = insert_batches(storage, "record", records())
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the crawl history to Parquet / Arrow IPC files, or load it back")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("-d", "--directory", default="history", help="where the files are")
+    parser.add_argument("-f", "--format", choices=tuple(extensions), default="parquet")
+    parser.add_argument("-c", "--chunk", type=int, default=10000, help="rows per chunk")
+    args = parser.parse_args()
+
+    with open("zhihu.json", "r", encoding="utf8") as f:
+        storage = make_storage(json.load(f))
+    if args.action == "export":
+        counts = export(storage, args.directory, args.format, args.chunk)
+    else:
+        counts = load(storage, args.directory, args.format, args.chunk)
+    storage.close()
+    print(", ".join(f"{name}: {count} rows" for name, count in counts.items()))
@@ -0,0 +1,170 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from replay import serve
+from zhihu import ZhihuCrawler
+
+# Whether a larger value of a metric is better, used by the regression check
+higher_is_better = {
+    "board_parse_ms": False,
+    "question_parse_ms": False,
+    "pages_per_sec": True,
+    "crawl_seconds": False,
+    "db_write_ms_per_crawl": False,
+    "peak_rss_mb": False,
+}
+
+
+def make_crawler(directory, base_url, storage, workers):
+    """
+    Create a crawler on the replay server with all the sleeps disabled
+
+    :param directory: a temporary directory for the SQLite database
+    :param base_url: URL of the replay server
+    :param storage: "sqlite" for a fresh local database, or "mysql" for the one in zhihu.json
+    :param workers: the number of question workers
+    :return: the crawler
+    """
+    with open("zhihu.json", "r", encoding="utf8") as f:
+        settings = json.load(f)
+    settings["config"].update({
+        "base_url": base_url,
+        "interval_between_question": 0,
+        "question_workers": workers,
+        "question_rate": 10 ** 9,
+        "question_burst": 10 ** 9,
+        "http_retries": 0,
+        "storage": storage,
+    })
+    settings["sqlite"] = {"path": os.path.join(directory, "bench.db")}
+    return ZhihuCrawler(settings)
+
+
+def time_storage(crawler):
+    """
+    Accumulate the time spent in the storage writes of the crawler
+
+    :return: dict whose "seconds" grows with each write
+    """
+    spent = {"seconds": 0.0}
+    lock = threading.Lock()
+
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            begin = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with lock:
+                    spent["seconds"] += time.perf_counter() - begin
+        return wrapper
+
+    for name in ("begin_crawl", "end_crawl", "add_entry", "add_detail"):
+        setattr(crawler.storage, name, timed(getattr(crawler.storage, name)))
+    return spent
+
+
+def run(pages, rounds, storage, workers) -> dict:
+    """
+    Benchmark parsing, fetching and full crawls on the recorded pages
+
+    :param pages: the directory of the recorded pages
+    :param rounds: the number of rounds of each stage
+    :param storage: the storage backend
+    :param workers: the number of question workers
+    :return: dict of the metrics
+    """
+    server = serve(pages)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    with tempfile.TemporaryDirectory() as directory:
+        crawler = make_crawler(directory, base_url, storage, workers)
+        crawler.create_table()
+
+        # Parsing only
+        board = crawler.fetch(base_url + "/hot").text
+        qids = [name[:-5] for name in os.listdir(os.path.join(pages, "question")) if name.endswith(".html")]
+        questions = [(qid, crawler.fetch(base_url + "/question/" + qid).content) for qid in qids]
+        begin = time.perf_counter()
+        for _ in range(rounds):
+            crawler.parse_board(board)
+        board_parse = (time.perf_counter() - begin) / rounds
+        begin = time.perf_counter()
+        for _ in range(rounds):
+            for qid, page in questions:
+                crawler.parse_question(page, qid)
+        question_parse = (time.perf_counter() - begin) / (rounds * max(len(questions), 1))
+
+        # Fetching and parsing
+        begin = time.perf_counter()
+        for _ in range(rounds):
+            crawler.get_board()
+            for qid in qids:
+                crawler.get_question(qid)
+        pages_per_sec = rounds * (1 + len(qids)) / (time.perf_counter() - begin)
+
+        # Full crawls
+        spent = time_storage(crawler)
+        crawler.stats.summary()
+        begin = time.perf_counter()
+        for _ in range(rounds):
+            if crawler.crawl() is None:
+                raise RuntimeError("A crawl stopped on an exception, see the log")
+        crawl_seconds = (time.perf_counter() - begin) / rounds
+        crawler.storage.close()
+    server.shutdown()
+
+    return {
+        "board_parse_ms": board_parse * 1000,
+        "question_parse_ms": question_parse * 1000,
+        "pages_per_sec": pages_per_sec,
+        "crawl_seconds": crawl_seconds,
+        "db_write_ms_per_crawl": spent["seconds"] * 1000 / rounds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """
+    :return: list of (metric, result, baseline) worse than the baseline by more than `tolerance`
+    """
+    worse = []
+    for name, value in results.items():
+        if name not in baseline or not baseline[name]:
+            continue
+        change = (value - baseline[name]) / baseline[name]
+        if (-change if higher_is_better[name] else change) > tolerance:
+            worse.append((name, value, baseline[name]))
+    return worse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawler throughput benchmark on pages recorded by replay.py")
+    parser.add_argument("-d", "--pages", default="replay", help="the directory of the recorded pages")
+    parser.add_argument("-n", "--rounds", type=int, default=5, help="rounds of each stage")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="question workers")
+    parser.add_argument("-s", "--storage", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--save-baseline", metavar="FILE", help="save the results as the baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results with the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run(args.pages, args.rounds, args.storage, args.workers)
+    for name, value in results.items():
+        print(f"{name:>22}: {value:10.3f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = regressions(results, json.load(f), args.tolerance)
+        for name, value, base in worse:
+            print(f"Regression in {name}: {value:.3f} vs baseline {base:.3f}")
+        sys.exit(1 if worse else 0)
@@ -0,0 +1,49 @@
+import argparse
+from benchutil import measure
+from board import parse_board_lxml, parse_board_soup
+
+
+def load_pages(paths):
+    """
+    :param paths: paths of saved board pages, e.g. replay/hot.html from `replay.py record`
+    :return: list of (path, page in str)
+    """
+    pages = []
+    for path in paths:
+        with open(path, "r", encoding="utf8") as f:
+            pages.append((path, f.read()))
+    return pages
+
+
+def check(pages):
+    """
+    Check that the lxml path returns the same entries as the soup path, and that the entries are complete
+
+    :return: the number of entries checked
+    """
+    count = 0
+    for path, page in pages:
+        fast, soup = parse_board_lxml(page), parse_board_soup(page)
+        assert fast, f"No entry found in {path}"
+        assert fast == soup, f"lxml path differs on {path}"
+        for entry in fast:
+            assert entry.qid.isdigit() and entry.title and entry.heat.endswith("热度"), f"Incomplete {entry} in {path}"
+        count += len(fast)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time the lxml board parser against the soup parser")
+    parser.add_argument("pages", nargs="*", default=["fixtures/hot.html"], help="saved board pages, e.g. replay/hot.html from `replay.py record`")
+    parser.add_argument("-n", "--rounds", type=int, default=50, help="rounds over the pages")
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages)
+    print(f"{check(pages)} entries agree")
+    calls = [(page,) for _, page in pages]
+    results = {name: measure(func, calls, args.rounds)
+               for name, func in (("soup", parse_board_soup), ("lxml", parse_board_lxml))}
+    for name, (cpu, peak) in results.items():
+        print(f"{name:>5}: {cpu * 1000:8.3f} ms CPU / page, {peak / 1024:9.1f} KB peak")
+    print(f"speedup {results['soup'][0] / results['lxml'][0]:.1f}x, "
+          f"memory {results['soup'][1] / results['lxml'][1]:.1f}x less")
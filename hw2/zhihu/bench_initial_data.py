@@ -0,0 +1,56 @@
+import argparse
+import json
+import re
+from bs4 import BeautifulSoup as BS
+from benchutil import measure
+from initial_data import extract_question
+
+
+def soup_path(page: bytes, qid):
+    """The full parse done by `get_question` before the fast path"""
+    script = BS(page.decode("utf8"), 'lxml').find('script', id="js-initialData").text
+    return json.loads(script)['initialState']["entities"]["questions"][str(qid)]
+
+
+def fast_path(page: bytes, qid):
+    return extract_question(page, qid)
+
+
+def load_pages(paths):
+    """
+    Load saved question pages, named like `<qid>.html`. Without paths, a page is built
+    from the js-initialData payload saved in .script.json
+
+    :param paths: paths of the saved pages
+    :return: list of (qid, page in bytes)
+    """
+    if not paths:
+        with open(".script.json", "r", encoding="utf8") as f:
+            script = json.load(f)
+        qid = next(iter(json.loads(script)['initialState']["entities"]["questions"]))
+        page = f'<html><head></head><body><div id="root"></div>' \
+               f'<script id="js-initialData" type="text/json">{script}</script></body></html>'
+        return [(qid, page.encode("utf8"))]
+    pages = []
+    for path in paths:
+        qid = re.search(r'(\d+)\.html?$', path).group(1)
+        with open(path, "rb") as f:
+            pages.append((qid, f.read()))
+    return pages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the js-initialData fast path with the full soup parse")
+    parser.add_argument("pages", nargs="*", help="saved question pages named <qid>.html")
+    parser.add_argument("-n", "--rounds", type=int, default=20, help="rounds over the pages")
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages)
+    for qid, page in pages:
+        assert fast_path(page, qid) == soup_path(page, qid), f"Fast path differs on question {qid}"
+    calls = [(page, qid) for qid, page in pages]
+    results = {name: measure(func, calls, args.rounds) for name, func in (("soup", soup_path), ("fast", fast_path))}
+    for name, (cpu, peak) in results.items():
+        print(f"{name:>5}: {cpu * 1000:8.3f} ms CPU / page, {peak / 1024:9.1f} KB peak")
+    print(f"speedup {results['soup'][0] / results['fast'][0]:.1f}x, "
+          f"memory {results['soup'][1] / results['fast'][1]:.1f}x less")
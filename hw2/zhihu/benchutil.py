@@ -0,0 +1,25 @@
+import time
+import tracemalloc
+
+
+def measure(func, calls, rounds):
+    """
+    Time a parser over saved pages, shared by the `bench_*.py` scripts
+
+    :param func: the function to measure
+    :param calls: list of argument tuples, one call of `func` each, e.g. [(page,), ...] or [(page, qid), ...]
+    :param rounds: rounds over the calls for the CPU time
+    :return: (CPU seconds per call, peak traced memory in bytes of one round)
+    """
+    begin = time.process_time()
+    for _ in range(rounds):
+        for args in calls:
+            func(*args)
+    cpu = (time.process_time() - begin) / (rounds * len(calls))
+
+    tracemalloc.start()
+    for args in calls:
+        func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
@@ -0,0 +1,124 @@
+import logging
+import re
+from bs4 import BeautifulSoup as BS
+from lxml import etree, html as lxml_html
+import metrics
+
+logger = logging.getLogger()
+
+qid_pattern = re.compile(r'question/(\d+)')
+heat_pattern = re.compile(r'.+热度')
+
+# A class token test, which is what `class_=` does in BeautifulSoup
+has_class = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+find_sections = etree.XPath(f"//section[{has_class.format('HotItem')}]")
+find_link = etree.XPath("(.//a)[1]")
+find_excerpt = etree.XPath(f"(.//p[{has_class.format('HotItem-excerpt')}])[1]")
+find_metrics = etree.XPath(f"(.//div[{has_class.format('HotItem-metrics')}])[1]")
+utf8_parser = lxml_html.HTMLParser(encoding="utf-8")
+
+
+class BoardEntry:
+    """
+    An entry of the hot board. It reads like a dict, e.g. entry["qid"], and `dict(entry)` converts it
+    """
+    __slots__ = ("title", "heat", "excerpt", "url", "qid")
+
+    def __init__(self, title, heat, excerpt, url, qid):
+        self.title = title
+        self.heat = heat
+        self.excerpt = excerpt
+        self.url = url
+        self.qid = qid
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def keys(self):
+        return self.__slots__
+
+    def __eq__(self, other):
+        return isinstance(other, BoardEntry) and all(self[k] == other[k] for k in self.__slots__)
+
+    def __repr__(self):
+        return f"BoardEntry({', '.join(f'{k}={self[k]!r}' for k in self.__slots__)})"
+
+
+def make_entry(url, title, excerpt, metrics_text):
+    """
+    :return: a `BoardEntry`, or None if the URL is not a question
+    :raise IndexError: if there is no heat in the metrics
+    """
+    m = qid_pattern.search(url)
+    if m is None:
+        metrics.parse_failures_total.inc(reason="no_qid")
+        return None
+    return BoardEntry(title, heat_pattern.findall(metrics_text)[0], excerpt, url, m.group(1))
+
+
+def parse_board(page) -> list:
+    """
+    Parse the hot question list from the board page with lxml and compiled XPath,
+    falling back to BeautifulSoup if no entry is found
+
+    :param page: the board page
+    :return: list of `BoardEntry`, ranking from high to low
+    """
+    entries = parse_board_lxml(page)
+    if not entries:
+        entries = parse_board_soup(page)
+    return entries
+
+
+def parse_board_lxml(page) -> list:
+    """
+    :param page: the board page, in str or UTF-8 bytes
+    :return: list of `BoardEntry`
+    """
+    if not page:
+        return []
+    if isinstance(page, str):
+        page = page.encode("utf8")  # lxml refuses a str with an encoding declaration
+    root = lxml_html.fromstring(page, parser=utf8_parser)
+    entries = []
+    for section in find_sections(root):
+        try:
+            a = find_link(section)[0]
+            excerpt = find_excerpt(section)
+            entry = make_entry(
+                a.attrib["href"], a.attrib["title"],
+                excerpt[0].text_content() if excerpt else None,
+                find_metrics(section)[0].text_content())
+        except (IndexError, KeyError) as e:
+            metrics.parse_failures_total.inc(reason=type(e).__name__)
+            logger.debug(f"Skip a board entry: {e!r}")
+            continue
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+def parse_board_soup(page) -> list:
+    """
+    The BeautifulSoup parse, kept as the reference of `parse_board_lxml`
+    """
+    soup = BS(page, 'lxml')
+    entries = []
+    for section in soup.find_all('section', class_="HotItem"):
+        try:
+            a = section.find('a')
+            excerpt = section.find('p', class_="HotItem-excerpt")
+            entry = make_entry(
+                a['href'], a['title'],
+                excerpt.text if excerpt is not None else None,
+                section.find('div', class_="HotItem-metrics").text)
+        except Exception as e:
+            metrics.parse_failures_total.inc(reason=type(e).__name__)
+            logger.debug(f"Skip a board entry: {e!r}")
+            continue
+        if entry is not None:
+            entries.append(entry)
+    return entries
@@ -0,0 +1,42 @@
+import os
+from board import BoardEntry, parse_board, parse_board_lxml, parse_board_soup
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "hot.html")
+
+# What the saved hot page must parse into. The column article (ranking 3) is not a question,
+# and the entry without heat (ranking 4) is skipped
+expected = [
+    BoardEntry("如何评价今年的高考作文题？", "1520 万热度", "今年全国卷作文题以“本手、妙手、俗手”为题，引发广泛讨论。",
+               "https://www.zhihu.com/question/541600869", "541600869"),
+    BoardEntry("为什么夏天的雨说下就下？", "862 万热度", None,
+               "https://www.zhihu.com/question/541600870", "541600870"),
+    BoardEntry("有哪些让人相见恨晚的学习方法？", "98 万热度", "  费曼学习法 & 间隔重复  ",
+               "https://www.zhihu.com/question/541600873?utm_division=hot_list_page", "541600873"),
+]
+
+
+def check_fixture():
+    """
+    Check both parsers against the saved hot page, given as str and as bytes
+    """
+    with open(fixture, "rb") as f:
+        content = f.read()
+    for page in (content, content.decode("utf8")):
+        for parse in (parse_board, parse_board_lxml, parse_board_soup):
+            entries = parse(page)
+            assert entries == expected, f"{parse.__name__} on {type(page).__name__}: {entries}"
+    # The excerpt is the text of the whole paragraph, including its child elements
+    assert parse_board(content)[0]["excerpt"].count("手") == 3
+    assert dict(parse_board(content)[1]) == {"title": "为什么夏天的雨说下就下？", "heat": "862 万热度", "excerpt": None,
+                                            "url": "https://www.zhihu.com/question/541600870", "qid": "541600870"}
+
+
+def check_empty():
+    for page in ("", b"", "<html><body><p>登录</p></body></html>"):
+        assert parse_board(page) == [], f"Entries found in {page!r}"
+
+
+if __name__ == "__main__":
+    check_fixture()
+    check_empty()
+    print(f"board parsers agree on {fixture}")
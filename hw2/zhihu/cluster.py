@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from jobqueue import JobQueue
+from logs import setup_logging
+from zhihu import ZhihuCrawler
+
+logger = logging.getLogger()
+
+
+def schedule(settings, stop, top=None):
+    """
+    Begin a crawl every `interval_between_board` seconds by queueing its board job
+
+    :param settings: the crawler settings
+    :param stop: an event to stop on
+    :param top: only look at the first `top` entries in the board
+    """
+    crawler = ZhihuCrawler(settings)
+    crawler.create_table()
+    queue = JobQueue(settings["queue"]["path"])
+    keep = settings["queue"].get("keep_crawls", 10)
+    while not stop.is_set():
+        begin_time = time.time()
+        crawl_id = crawler.begin_crawl(begin_time)
+        queue.open_crawl(crawl_id, "board", {"top": top})
+        queue.purge(crawl_id - keep)
+        logger.info(f"Crawl {crawl_id} scheduled")
+        stop.wait(max(0, settings["config"]["interval_between_board"] - (time.time() - begin_time)))
+    queue.close()
+
+
+def run_job(crawler, job):
+    """
+    Run a job: a board job lists the questions to fetch, a question job fetches one of them.
+    Nothing is written here; the results are written once the lease is confirmed
+
+    :param crawler: the crawler of this worker
+    :param job: the leased job
+    :return: ((kind, payload, dedup) of the jobs it produced, (ranking, item, detail) of the records to add)
+    """
+    if job.kind == "board":
+        board_entries = crawler.get_board()[:job.payload["top"]]
+        logger.info(f"Get {len(board_entries)} items for crawl {job.crawl_id}")
+        children, entries = [], []
+        for idx, item in enumerate(board_entries):
+            if item["qid"] is None:
+                logger.warning(f"Unparsed URL @ {item['url']} ranking {idx} in crawl {job.crawl_id}.")
+                entries.append((idx, dict(item), crawler.empty_detail()))
+            else:
+                # Each qid is fetched once per crawl
+                children.append(("question", {"idx": idx, "item": dict(item)}, f"{job.crawl_id}:{item['qid']}"))
+        return children, entries
+
+    idx, item = job.payload["idx"], job.payload["item"]
+    crawler.limiter.acquire()
+    detail = crawler.question_detail(item["qid"])
+    logger.info(f"Get question detail for {item['title']}: raw detail length {len(detail['raw']) if detail['raw'] else 0}",
+                extra={"sample": True})
+    return (), [(idx, item, detail)]
+
+
+def give_up(crawler, job):
+    """
+    Keep the ranking of a question job failed for good, like `watch` does for a failed question
+
+    """
+    if job.kind != "question":
+        return
+    try:
+        crawler.add_entry(job.crawl_id, job.payload["idx"], job.payload["item"], crawler.empty_detail())
+    except Exception as e:
+        logger.exception(f"Exception when adding entry {e}")
+
+
+def finish(crawler, crawl_id):
+    crawler.end_crawl(crawl_id)
+    logger.info(f"Crawl {crawl_id} finished")
+
+
+def work(settings, name, stop):
+    """
+    Lease and run jobs until stopped. The worker finishing the last job of a crawl ends the crawl
+
+    :param settings: the crawler settings
+    :param name: name of this worker
+    :param stop: an event to stop on
+    """
+    setup_logging(settings.get("logging"))  # The listener thread of the parent is not forked
+    crawler = ZhihuCrawler(settings)
+    config = settings["queue"]
+    queue = JobQueue(config["path"])
+    lease, max_attempts = config.get("lease", 120), config.get("max_attempts", 3)
+    while not stop.is_set():
+        for job, closed in queue.expire(max_attempts):
+            logger.error(f"Job {job.id} ({job.kind}) of crawl {job.crawl_id} expired on attempt {job.attempts}, failed")
+            give_up(crawler, job)
+            if closed:
+                finish(crawler, job.crawl_id)
+        job = queue.lease(name, lease)
+        if job is None:
+            stop.wait(config.get("poll", 1))
+            continue
+        try:
+            try:
+                children, entries = run_job(crawler, job)
+            finally:
+                # The requests of this job
+                stats = crawler.stats.summary()
+                logger.debug(f"Job {job.id} made {stats['requests']} requests, "
+                             f"{stats['bytes'] / 1024:.1f} KB, {stats['seconds']:.2f} s")
+            if not queue.renew(job, lease):
+                logger.warning(f"Job {job.id} ({job.kind}) of crawl {job.crawl_id} lost its lease, result dropped")
+                continue
+            for idx, item, detail in entries:
+                crawler.add_entry(job.crawl_id, idx, item, detail)
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) of crawl {job.crawl_id} failed on attempt {job.attempts}: {e}")
+            final, closed = queue.fail(job, str(e), max_attempts, config.get("retry_delay", 30))
+            if final:
+                give_up(crawler, job)
+        else:
+            owned, closed = queue.done(job, children)
+            if not owned:
+                logger.warning(f"Job {job.id} ({job.kind}) of crawl {job.crawl_id} lost its lease after writing")
+        if closed:
+            finish(crawler, job.crawl_id)
+    queue.close()
+    crawler.storage.close()
+
+
+def worker_name(i):
+    return f"{socket.gethostname()}-{os.getpid()}-{i}"
+
+
+def start_workers(settings, n, stop):
+    """
+    Start `n` worker processes. The request rate of each is cut so that they add up to `question_rate`
+
+    :return: the processes
+    """
+    settings = json.loads(json.dumps(settings))
+    config = settings["config"]
+    config["question_rate"] = config.get("question_rate", 0.5) / n
+    config["question_burst"] = max(1, config.get("question_burst", 1) // n)
+    config["question_workers"] = 1
+    processes = [
+        multiprocessing.Process(target=work, args=(settings, worker_name(i), stop), name=f"worker-{i}")
+        for i in range(n)
+    ]
+    for p in processes:
+        p.start()
+    return processes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl with a scheduler and worker processes sharing a job queue")
+    parser.add_argument("role", choices=("run", "scheduler", "worker"),
+                        help="run: the scheduler and the workers; or only one of them")
+    parser.add_argument("-w", "--workers", type=int, help="worker processes, queue.workers by default")
+    parser.add_argument("-t", "--top", type=int, help="only look at the first TOP entries in the board")
+    args = parser.parse_args()
+
+    with open("zhihu.json", "r", encoding="utf8") as f:
+        settings = json.load(f)
+    setup_logging(settings.get("logging"))
+    n = args.workers or settings["queue"].get("workers", 4)
+    stop = multiprocessing.Event()
+    processes = start_workers(settings, n, stop) if args.role in ("run", "worker") else []
+    try:
+        if args.role == "worker":
+            for p in processes:
+                p.join()
+        else:
+            schedule(settings, stop, args.top)
+    except KeyboardInterrupt:
+        logger.info("Stopping ...")
+    finally:
+        stop.set()
+        for p in processes:
+            p.join()
@@ -0,0 +1,60 @@
+import json
+import re
+
+# The opening tag of the script holding the page state, e.g. <script id="js-initialData" type="text/json">
+script_begin = re.compile(rb'<script[^>]*\bid="js-initialData"[^>]*>')
+script_end = b'</script>'
+questions_begin = re.compile(r'"questions"\s*:\s*\{')
+decoder = json.JSONDecoder()
+
+
+def find_script(page: bytes):
+    """
+    Locate the js-initialData payload in the raw page, without parsing the HTML
+
+    :param page: the page content in bytes
+    :return: (begin, end) offsets of the payload, or None if there is no such script
+    """
+    m = script_begin.search(page)
+    if m is None:
+        return None
+    end = page.find(script_end, m.end())
+    if end < 0:
+        return None
+    return m.end(), end
+
+
+def extract_question(page: bytes, qid):
+    """
+    Decode only `initialState.entities.questions[qid]` from the js-initialData payload.
+    The payload is decoded to text once and scanned for the key of the question inside `questions`,
+    then the object behind it is decoded with `raw_decode`, which stops at the end of that object.
+    A key that turns out to belong to something else is skipped by the `id` check.
+
+    :param page: the page content in bytes
+    :param qid: Question ID
+    :return: dict of the question entity, or None if the page layout is not recognized
+    """
+    span = find_script(page)
+    if span is None:
+        return None
+    begin, end = span
+    entities = page.find(b'"entities"', begin, end)
+    if entities < 0:
+        return None
+    try:
+        text = page[entities:end].decode("utf8")
+    except UnicodeDecodeError:
+        return None
+    questions = questions_begin.search(text)
+    if questions is None:
+        return None
+    key = re.compile(r'"' + str(qid) + r'"\s*:\s*')
+    for m in key.finditer(text, questions.end()):
+        try:
+            question, _ = decoder.raw_decode(text, m.end())
+        except ValueError:
+            continue
+        if isinstance(question, dict) and str(question.get("id")) == str(qid):
+            return question
+    return None
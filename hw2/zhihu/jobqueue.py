@@ -0,0 +1,208 @@
+import json
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+Job = namedtuple("Job", ["id", "kind", "crawl_id", "payload", "attempts", "worker"])
+
+# A job is still held by the lease it was given; the attempt count tells a re-lease by the same worker apart
+owned = "`id` = ? AND `state` = 'leased' AND `worker` = ? AND `attempts` = ?"
+
+
+class JobQueue:
+    def __init__(self, path):
+        """
+        A durable job queue in a SQLite file, shared by the processes on one host.
+        A job is leased by one worker at a time; a lease that is not finished in time expires,
+        and the job is given to another worker. The updates of a job only take effect while its lease is held.
+
+        :param path: the queue file
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode = WAL;")
+        self.conn.executescript("""
+CREATE TABLE IF NOT EXISTS `job` (
+    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `kind` TEXT NOT NULL,
+    `crawl_id` INTEGER NOT NULL,
+    `dedup` TEXT UNIQUE,
+    `payload` TEXT NOT NULL,
+    `state` TEXT NOT NULL DEFAULT 'ready',
+    `attempts` INTEGER NOT NULL DEFAULT 0,
+    `worker` TEXT,
+    `not_before` REAL NOT NULL DEFAULT 0,
+    `lease_until` REAL,
+    `error` TEXT
+);
+CREATE INDEX IF NOT EXISTS `JobState` ON `job` (`state`, `not_before`);
+CREATE INDEX IF NOT EXISTS `JobCrawl` ON `job` (`crawl_id`, `state`);
+
+CREATE TABLE IF NOT EXISTS `open_crawl` (
+    `crawl_id` INTEGER PRIMARY KEY
+);
+""")
+
+    @contextmanager
+    def transaction(self):
+        """
+        A write transaction, locked before reading so that two workers never claim the same job
+
+        """
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK;")
+            raise
+        self.conn.execute("COMMIT;")
+
+    def open_crawl(self, crawl_id, kind, payload):
+        """
+        Register a crawl with its first job
+
+        :param crawl_id: Crawl ID
+        :param kind: kind of the first job
+        :param payload: JSON-serializable payload of the first job
+        """
+        with self.transaction():
+            self.conn.execute("INSERT OR IGNORE INTO `open_crawl` VALUES (?);", (crawl_id,))
+            self._put(kind, crawl_id, payload, None)
+
+    def put(self, kind, crawl_id, payload, dedup=None):
+        """
+        Add a job, unless a job with the same `dedup` key exists
+
+        :param kind: the job kind, e.g. "board" or "question"
+        :param crawl_id: Crawl ID the job belongs to
+        :param payload: JSON-serializable payload
+        :param dedup: dedup key, e.g. the qid within a crawl
+        :return: True if the job is added
+        """
+        with self.transaction():
+            return self._put(kind, crawl_id, payload, dedup)
+
+    def _put(self, kind, crawl_id, payload, dedup):
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO `job` (`kind`, `crawl_id`, `dedup`, `payload`) VALUES (?, ?, ?, ?);",
+            (kind, crawl_id, dedup, json.dumps(payload, ensure_ascii=False)))
+        return cur.rowcount == 1
+
+    def lease(self, worker, seconds):
+        """
+        Take the oldest ready job, or a job whose lease expired
+
+        :param worker: name of the worker
+        :param seconds: length of the lease
+        :return: a `Job`, or None if there is nothing to do
+        """
+        now = time.time()
+        with self.transaction():
+            row = self.conn.execute("""
+SELECT * FROM `job`
+WHERE (`state` = 'ready' AND `not_before` <= ?) OR (`state` = 'leased' AND `lease_until` < ?)
+ORDER BY `id` LIMIT 1;
+""", (now, now)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("""
+UPDATE `job` SET `state` = 'leased', `worker` = ?, `lease_until` = ?, `attempts` = `attempts` + 1
+WHERE `id` = ?;
+""", (worker, now + seconds, row["id"]))
+        return Job(row["id"], row["kind"], row["crawl_id"], json.loads(row["payload"]), row["attempts"] + 1, worker)
+
+    def expire(self, max_attempts):
+        """
+        Fail the jobs whose lease expired on their last attempt, e.g. a job that kills its worker,
+        instead of leasing them again
+
+        :param max_attempts: the maximum number of attempts
+        :return: list of (the failed `Job`, True if its crawl is closed by this call)
+        """
+        with self.transaction():
+            rows = self.conn.execute(
+                "SELECT * FROM `job` WHERE `state` = 'leased' AND `lease_until` < ? AND `attempts` >= ?;",
+                (time.time(), max_attempts)).fetchall()
+            expired = []
+            for row in rows:
+                self.conn.execute(
+                    "UPDATE `job` SET `state` = 'failed', `error` = 'lease expired' WHERE `id` = ?;", (row["id"],))
+                expired.append(Job(row["id"], row["kind"], row["crawl_id"], json.loads(row["payload"]),
+                                   row["attempts"], row["worker"]))
+            return [(job, self._close_if_finished(job.crawl_id)) for job in expired]
+
+    def renew(self, job: Job, seconds):
+        """
+        Extend the lease of a job before writing its results, so that they are not written twice
+
+        :param job: the leased job
+        :param seconds: length of the new lease
+        :return: False if the lease was lost to another worker
+        """
+        with self.transaction():
+            return self.conn.execute(f"UPDATE `job` SET `lease_until` = ? WHERE {owned};",
+                                     (time.time() + seconds, job.id, job.worker, job.attempts)).rowcount == 1
+
+    def done(self, job: Job, children=()):
+        """
+        Finish a job, adding the jobs it produced in the same transaction
+
+        :param job: the leased job
+        :param children: (kind, payload, dedup) of the jobs to add to the same crawl
+        :return: (False if the lease was lost and nothing is changed,
+                  True if it was the last open job of its crawl, and the crawl is closed by this call)
+        """
+        with self.transaction():
+            if self.conn.execute(f"UPDATE `job` SET `state` = 'done', `error` = NULL WHERE {owned};",
+                                 (job.id, job.worker, job.attempts)).rowcount == 0:
+                return False, False
+            for kind, payload, dedup in children:
+                self._put(kind, job.crawl_id, payload, dedup)
+            return True, self._close_if_finished(job.crawl_id)
+
+    def fail(self, job: Job, error, max_attempts, delay):
+        """
+        Give a job back for a retry after `delay` seconds, or fail it for good after `max_attempts`
+
+        :param job: the leased job
+        :param error: what went wrong
+        :param max_attempts: the maximum number of attempts
+        :param delay: seconds before the retry, doubled on each attempt
+        :return: (True if failed for good, True if the crawl is closed by this call);
+                 (False, False) if the lease was lost and nothing is changed
+        """
+        final = job.attempts >= max_attempts
+        with self.transaction():
+            if final:
+                cur = self.conn.execute(f"UPDATE `job` SET `state` = 'failed', `error` = ? WHERE {owned};",
+                                        (error, job.id, job.worker, job.attempts))
+            else:
+                cur = self.conn.execute(
+                    f"UPDATE `job` SET `state` = 'ready', `error` = ?, `not_before` = ? WHERE {owned};",
+                    (error, time.time() + delay * 2 ** (job.attempts - 1), job.id, job.worker, job.attempts))
+            if cur.rowcount == 0:
+                return False, False
+            return final, final and self._close_if_finished(job.crawl_id)
+
+    def _close_if_finished(self, crawl_id):
+        left = self.conn.execute(
+            "SELECT COUNT(*) FROM `job` WHERE `crawl_id` = ? AND `state` IN ('ready', 'leased');",
+            (crawl_id,)).fetchone()[0]
+        if left:
+            return False
+        return self.conn.execute("DELETE FROM `open_crawl` WHERE `crawl_id` = ?;", (crawl_id,)).rowcount == 1
+
+    def purge(self, before_crawl_id):
+        """
+        Delete the finished jobs of crawls older than `before_crawl_id`, to keep the queue small
+
+        """
+        with self.transaction():
+            self.conn.execute(
+                "DELETE FROM `job` WHERE `crawl_id` < ? AND `state` IN ('done', 'failed');", (before_crawl_id,))
+
+    def close(self):
+        self.conn.close()
+
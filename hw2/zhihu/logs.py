@@ -0,0 +1,126 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+fmt = '%(asctime)s.%(msecs)03d [%(levelname)s] %(message)s'
+datefmt = '%Y-%m-%d %H:%M:%S'
+
+# What `setup_logging` installed, replaced when it is called again
+_installed = {"handlers": [], "outputs": [], "listener": None, "filter": None}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, thread, message, and the exception if any
+    """
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate):
+        """
+        Keep a `rate` share of the records logged with `extra={"sample": True}`, evenly spread;
+        the other records all pass
+
+        :param rate: share of the sampled records to keep, in [0, 1]
+        """
+        super().__init__()
+        self.rate = rate
+        self.credit = 0.0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sample", False):
+            return True
+        with self.lock:
+            self.credit += self.rate
+            if self.credit >= 1:
+                self.credit -= 1
+                return True
+        return False
+
+
+def file_handler(options) -> logging.Handler:
+    """
+    :param options: the logging settings
+    :return: a file handler, rotated by size, by time or not at all
+    """
+    path = options.get("file", "../zhihu.log")
+    rotate = options.get("rotate")
+    backups = options.get("backup_count", 5)
+    if rotate == "size":
+        return logging.handlers.RotatingFileHandler(
+            path, maxBytes=options.get("max_bytes", 10 * 1024 * 1024), backupCount=backups, encoding="utf-8")
+    if rotate == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=options.get("when", "midnight"), backupCount=backups, encoding="utf-8")
+    return logging.FileHandler(path, encoding="utf-8")
+
+
+def setup_logging(options=None):
+    """
+    Configure the root logger to write to a file and the console. Calling it again replaces
+    the previous configuration, e.g. in a forked process whose listener thread is not running.
+
+    :param options: the "logging" settings in zhihu.json:
+                    `level`, `file`, `json` for JSON lines, `rotate` ("size" or "time") with `max_bytes`,
+                    `when` and `backup_count`, `async` to write from a background thread, and `sample`,
+                    the share of per-item lines kept
+    """
+    options = options or {}
+    level = getattr(logging, options.get("level", "INFO"))
+    logger = logging.getLogger()
+    logger.setLevel(level)
+
+    if _installed["listener"] is not None:
+        _installed["listener"].stop()  # Returns at once in a forked process, where its thread is gone
+    for handler in _installed["handlers"]:
+        logger.removeHandler(handler)
+    for handler in _installed["outputs"]:
+        handler.close()
+    if _installed["filter"] is not None:
+        logger.removeFilter(_installed["filter"])
+
+    formatter = JSONFormatter() if options.get("json", False) else logging.Formatter(fmt, datefmt)
+    handlers = [file_handler(options), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+
+    if options.get("async", False):
+        # The callers only put records in a queue, a listener thread does the disk and terminal I/O
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        installed = [logging.handlers.QueueHandler(records)]
+    else:
+        listener = None
+        installed = handlers
+    for handler in installed:
+        logger.addHandler(handler)
+    # On the logger, so dropped lines are not even put in the queue
+    sample = SampleFilter(options.get("sample", 1))
+    logger.addFilter(sample)
+    _installed.update(handlers=installed, outputs=handlers, listener=listener, filter=sample)
+
+
+@atexit.register
+def _flush():
+    if _installed["listener"] is not None:
+        _installed["listener"].stop()
+        _installed["listener"] = None
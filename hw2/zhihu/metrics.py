@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger()
+
+# Upper bounds in seconds, from parsing a small page to sleeping a long board interval
+default_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        """
+        A metric with a value per combination of label values, in the Prometheus text format
+
+        :param name: the metric name
+        :param help: what it measures
+        :param labels: the label names
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value
+
+    def key(self, labels) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def label_text(self, key, extra=()) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def snapshot(self) -> dict:
+        """
+        :return: label values joined by "," -> value
+        """
+        with self.lock:
+            return {",".join(key): value for key, value in self.values.items()}
+
+    def render(self):
+        with self.lock:
+            for key, value in self.values.items():
+                yield f"{self.name}{self.label_text(key)} {value}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0, 0]  # Bucket counts, sum, count
+            counts, _, _ = entry = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the seconds spent in the block
+        """
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - begin, **labels)
+
+    def snapshot(self) -> dict:
+        """
+        :return: label values joined by "," -> {"count": observations, "sum": sum of them}
+        """
+        with self.lock:
+            return {",".join(key): {"count": count, "sum": total} for key, (_, total, count) in self.values.items()}
+
+    def render(self):
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, n in zip(self.buckets, counts):
+                    yield f"{self.name}_bucket{self.label_text(key, [('le', bound)])} {n}"
+                yield f"{self.name}_bucket{self.label_text(key, [('le', '+Inf')])} {count}"
+                yield f"{self.name}_sum{self.label_text(key)} {total}"
+                yield f"{self.name}_count{self.label_text(key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """
+        :return: metric name -> `Metric.snapshot`
+        """
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+
+def diff(before, after) -> dict:
+    """
+    What the counters and histograms gained between two `Registry.snapshot`, with the gauges as in `after`
+
+    :return: a snapshot of the same shape, without the unchanged values
+    """
+    result = {}
+    for name, values in after.items():
+        changed = {}
+        for key, value in values.items():
+            old = before.get(name, {}).get(key)
+            if isinstance(value, dict):
+                old = old or {"count": 0, "sum": 0}
+                if value["count"] != old["count"]:
+                    changed[key] = {"count": value["count"] - old["count"], "sum": value["sum"] - old["sum"]}
+            elif name in gauges:
+                changed[key] = value
+            elif value != (old or 0):
+                changed[key] = value - (old or 0)
+        if changed:
+            result[name] = changed
+    return result
+
+
+registry = Registry()
+stage_seconds = registry.add(Histogram(
+    "zhihu_stage_seconds", "Seconds spent in each stage of a crawl: fetch, parse, db and sleep", ("stage",)))
+requests_total = registry.add(Counter("zhihu_requests_total", "HTTP responses by status code", ("status",)))
+parse_failures_total = registry.add(Counter(
+    "zhihu_board_parse_failures_total", "Board entries skipped by the parser, by reason", ("reason",)))
+crawls_total = registry.add(Counter("zhihu_crawls_total", "Crawls by result: ok or failed", ("result",)))
+crawl_seconds = registry.add(Histogram("zhihu_crawl_seconds", "Duration of a crawl"))
+crawl_lag_seconds = registry.add(Gauge(
+    "zhihu_crawl_lag_seconds", "How late the last crawl began against its schedule"))
+gauges = {crawl_lag_seconds.name}
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve the metrics on http://<host>:<port>/metrics in a background thread
+
+    :return: the server
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,94 @@
+import argparse
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+question_path = re.compile(r'^/question/(\d+)/?$')
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Serve recorded pages as a stand-in of www.zhihu.com:
+    /hot from `<directory>/hot.html`, /question/<qid> from `<directory>/question/<qid>.html`
+    """
+    directory = "replay"
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real site
+    disable_nagle_algorithm = True  # Headers and body are written apart
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        file = None
+        if path == "/hot":
+            file = os.path.join(self.directory, "hot.html")
+        else:
+            m = question_path.match(path)
+            if m:
+                file = os.path.join(self.directory, "question", m.group(1) + ".html")
+        if file is None or not os.path.exists(file):
+            self.send_error(404)
+            return
+        with open(file, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Requests are counted by the crawler
+
+
+def serve(directory, port=0) -> ThreadingHTTPServer:
+    """
+    Serve the recorded pages in a background thread
+
+    :param directory: where the pages are recorded
+    :param port: the port to listen on, 0 to pick a free one
+    :return: the server, whose `server_port` is the port listened on
+    """
+    handler = type("Handler", (ReplayHandler,), {"directory": directory})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def record(crawler, directory, top=None):
+    """
+    Save the current board page and the question pages on it
+
+    :param crawler: a `ZhihuCrawler` pointing at the real site
+    :param directory: where to save the pages
+    :param top: only save the first `top` questions
+    :return: the number of question pages saved
+    """
+    base_url = crawler.settings["config"].get("base_url", "https://www.zhihu.com")
+    os.makedirs(os.path.join(directory, "question"), exist_ok=True)
+    res = crawler.fetch(base_url + "/hot")
+    with open(os.path.join(directory, "hot.html"), "wb") as f:
+        f.write(res.content)
+    entries = crawler.parse_board(res.text)[:top]
+    for item in entries:
+        crawler.limiter.acquire()
+        res = crawler.fetch(base_url + "/question/" + str(item["qid"]))
+        with open(os.path.join(directory, "question", f"{item['qid']}.html"), "wb") as f:
+            f.write(res.content)
+    return len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record zhihu pages, or serve the recorded pages locally")
+    parser.add_argument("action", choices=("record", "serve"))
+    parser.add_argument("-d", "--directory", default="replay", help="where the pages are recorded")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="the port to serve on")
+    parser.add_argument("-t", "--top", type=int, help="only record the first TOP questions")
+    args = parser.parse_args()
+
+    if args.action == "record":
+        from zhihu import ZhihuCrawler
+        print(f"Recorded {record(ZhihuCrawler(), args.directory, args.top)} questions in {args.directory}")
+    else:
+        server = serve(args.directory, args.port)
+        print(f"Serving {args.directory} on http://127.0.0.1:{server.server_port}, set it as config.base_url")
+        threading.Event().wait()
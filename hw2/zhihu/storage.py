@@ -0,0 +1,874 @@
+import json
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import pymysql
+
+logger = logging.getLogger()
+
+heat_pattern = re.compile(r'([\d.]+)\s*(万|亿)?')
+heat_units = {None: 1, '万': 10 ** 4, '亿': 10 ** 8}
+
+
+def parse_heat(heat):
+    """
+    Parse the heat shown on the board into a number
+
+    :param heat: e.g. '76万热度', '1450 万热度'
+    :return: e.g. 760000, or None if it cannot be parsed
+    """
+    m = heat_pattern.search(heat or "")
+    if m is None:
+        return None
+    return int(float(m.group(1)) * heat_units[m.group(2)])
+
+
+def record_row(crawl_id, idx, board, detail) -> tuple:
+    """
+    Build the arguments of `record_sql` for a question entry.
+    A detail from `refresh_question` keeps its `raw` in `question_detail`, so only the hash is stored
+
+    :param crawl_id: Crawl ID
+    :param idx: Ranking in the board
+    :param board: dict, info from the board
+    :param detail: dict, info from the detail page
+    :return: a tuple in the column order of `record_sql`
+    """
+    return (
+        board["qid"],
+        crawl_id,
+        board["title"],
+        board["heat"],
+        detail["created"],
+        detail["visitCount"],
+        detail["followerCount"],
+        detail["answerCount"],
+        board["excerpt"],
+        None if detail.get("detail_hash") else detail["raw"],
+        idx,
+        detail["hit_at"],
+        board["url"],
+        detail.get("detail_hash"),
+        parse_heat(board["heat"])
+    )
+
+
+def rollup_row(row) -> tuple:
+    """
+    Build the arguments of `rollup_sql` from a record row
+
+    :param row: a tuple from `record_row`
+    :return: a tuple in the column order of `rollup_sql`
+    """
+    seen = row[11] or time.time()
+    return row[0], row[2], seen, seen, row[10], row[14]
+
+
+def make_storage(settings):
+    """
+    Create the storage backend chosen by `storage` in the config
+
+    :param settings: the crawler settings
+    :return: a `Storage`
+    """
+    config = settings["config"]
+    backend = config.get("storage", "mysql")
+    rollup = config.get("rollup", False)
+    if backend == "mysql":
+        pool = ConnectionPool(
+            size=config.get("mysql_pool_size", 4),
+            ping_interval=config.get("mysql_ping_interval", 60),
+            **settings['mysql']
+        )
+        return MySQLStorage(pool, rollup)
+    if backend == "sqlite":
+        return SQLiteStorage(settings["sqlite"]["path"], rollup)
+    raise ValueError(f"Unknown storage backend {backend}")
+
+
+class ConnectionPool:
+    def __init__(self, size=4, ping_interval=60, timeout=None, **kwargs):
+        """
+        A bounded pool of MySQL connections, checked out per thread
+
+        :param size: the maximum number of connections opened at the same time
+        :param ping_interval: an idle connection older than this (seconds) is pinged before reuse
+        :param timeout: seconds to wait for a free connection, None to wait forever
+        :param kwargs: the arguments passed to `pymysql.connect`
+        """
+        self.size = size
+        self.ping_interval = ping_interval
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self._idle = queue.LifoQueue()  # (connection, time of last use)
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+
+    def _connect(self):
+        return pymysql.connect(
+            cursorclass=pymysql.cursors.DictCursor,
+            client_flag=pymysql.constants.CLIENT.MULTI_STATEMENTS,
+            **self.kwargs
+        )
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        """
+        Take an idle connection, checking its health, or open a new one
+
+        :return: a usable connection
+        """
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.time() - last_used < self.ping_interval:
+                return conn
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except pymysql.err.Error:
+                logger.warning("Dropped a dead MySQL connection")
+                self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the current thread. Nested checkouts on the same thread share it.
+        A connection is rolled back on error, and dropped if even that fails.
+
+        :return: a context manager yielding the connection
+        """
+        local = self._local
+        if getattr(local, "conn", None) is not None:
+            yield local.conn
+            return
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No free MySQL connection in {self.timeout} second(s)")
+        conn = None
+        try:
+            conn = self._checkout()
+            local.conn = conn
+            yield conn
+        except BaseException:
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    self._discard(conn)
+                    conn = None
+            raise
+        finally:
+            local.conn = None
+            if conn is not None:
+                self._idle.put((conn, time.time()))
+            self._slots.release()
+
+    def close(self):
+        """
+        Close all the idle connections
+
+        """
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+class Storage:
+    """
+    Where the crawls are stored. A backend provides `query`, `transaction` and `create_table`,
+    the statements below in the parameter style of its driver, and the error classes of its driver
+    """
+    placeholder = None  # The parameter marker of the driver
+    begin_sql = None
+    end_sql = None
+    record_sql = None
+    rollup_sql = None
+    detail_sql = None
+    metrics_sql = None
+    follow_sql = None
+    poll_sql = None
+    delta_sql = None
+    checkpoint_sql = None
+    broken_errors = ()  # The connection itself is broken
+    rejected_errors = ()  # The statement is rejected
+
+    def __init__(self, rollup=False):
+        """
+        :param rollup: maintain `question_rollup` when adding entries
+        """
+        self.rollup = rollup
+
+    def query(self, sql, args=None, op=None):
+        raise NotImplementedError
+
+    def transaction(self):
+        """
+        :return: a context manager yielding (connection, cursor). It is rolled back on error
+        """
+        raise NotImplementedError
+
+    def create_table(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def begin_crawl(self, begin_time) -> int:
+        """
+        Mark the beginning of a crawl
+
+        :param begin_time: the time marked when crawl begin
+        :return: Crawl ID
+        """
+        return self.query(self.begin_sql, begin_time, lambda x: x.lastrowid)
+
+    def end_crawl(self, crawl_id: int, rows=None):
+        """
+        Mark the ending time of a crawl
+
+        :param crawl_id: Crawl ID
+        :param rows: buffered record rows from `record_row`. If given, they are inserted together
+                     with the ending time in one transaction
+        """
+        if rows is None:
+            self.query(self.end_sql, (time.time(), crawl_id))
+            return
+        with self.transaction() as (conn, cur):
+            rows = self.insert_records(conn, cur, rows)
+            try:
+                if rows and self.rollup:
+                    cur.executemany(self.rollup_sql, [rollup_row(row) for row in rows])
+                cur.execute(self.end_sql, (time.time(), crawl_id))
+                conn.commit()
+            except:  # Log query then exit
+                logger.error("Exception @ " + getattr(cur, "_last_executed", self.end_sql))
+                raise
+        logger.info(f"Crawl {crawl_id} flushed with {len(rows)} records")
+
+    def save_checkpoint(self, crawl_id, board_entries):
+        """
+        Save the board of a crawl in progress, so the crawl can be resumed
+
+        :param crawl_id: Crawl ID
+        :param board_entries: the entries from `get_board`
+        """
+        self.query(self.checkpoint_sql, (crawl_id, json.dumps([dict(item) for item in board_entries], ensure_ascii=False), time.time()))
+
+    def flush_records(self, crawl_id, rows):
+        """
+        Insert buffered record rows of a crawl in progress and touch its checkpoint, in one transaction
+
+        :param crawl_id: Crawl ID
+        :param rows: record rows from `record_row`
+        """
+        p = self.placeholder
+        with self.transaction() as (conn, cur):
+            rows = self.insert_records(conn, cur, rows)
+            if rows and self.rollup:
+                cur.executemany(self.rollup_sql, [rollup_row(row) for row in rows])
+            cur.execute(f"UPDATE `crawl_checkpoint` SET `updated` = {p} WHERE `crawl_id` = {p};", (time.time(), crawl_id))
+            conn.commit()
+
+    def open_checkpoints(self) -> list:
+        """
+        Drop the checkpoints of ended crawls
+
+        :return: the checkpoints of the crawls not ended, (crawl_id, board, updated)
+        """
+        self.query("DELETE FROM `crawl_checkpoint` WHERE `crawl_id` IN (SELECT `id` FROM `crawl` WHERE `end` IS NOT NULL);")
+        return self.query("""
+SELECT `crawl_id`, `board`, `updated` FROM `crawl_checkpoint`
+WHERE `crawl_id` IN (SELECT `id` FROM `crawl` WHERE `end` IS NULL) ORDER BY `crawl_id`;
+""", None, lambda x: x.fetchall())
+
+    def end_stale_crawls(self, before) -> list:
+        """
+        End the open crawls begun before `before` that have no checkpoint, e.g. those whose board fetch failed,
+        at their beginning time
+
+        :param before: a timestamp
+        :return: IDs of the crawls ended
+        """
+        stale = f"""
+WHERE `end` IS NULL AND `begin` < {self.placeholder} AND `id` NOT IN (SELECT `crawl_id` FROM `crawl_checkpoint`)"""
+        rows = self.query(f"SELECT `id` FROM `crawl` {stale};", (before,), lambda x: x.fetchall())
+        if rows:
+            self.query(f"UPDATE `crawl` SET `end` = `begin` {stale};", (before,))
+        return [row["id"] for row in rows]
+
+    def finished_rankings(self, crawl_id) -> set:
+        """
+        :return: the rankings of the entries of a crawl that are stored
+        """
+        rows = self.query(f"SELECT `ranking` FROM `record` WHERE `crawl_id` = {self.placeholder};", (crawl_id,),
+                          lambda x: x.fetchall())
+        return {row["ranking"] for row in rows}
+
+    def drop_checkpoint(self, crawl_id, end=None):
+        """
+        Drop the checkpoint of a crawl
+
+        :param crawl_id: Crawl ID
+        :param end: if given, also end the crawl at this time, for a crawl that is given up
+        """
+        p = self.placeholder
+        with self.transaction() as (conn, cur):
+            if end is not None:
+                cur.execute(self.end_sql, (end, crawl_id))
+            cur.execute(f"DELETE FROM `crawl_checkpoint` WHERE `crawl_id` = {p};", (crawl_id,))
+            conn.commit()
+
+    def add_entry(self, crawl_id, idx, board, detail):
+        """
+        Add a question entry to database
+
+        :param crawl_id: Crawl ID
+        :param idx: Ranking in the board
+        :param board: dict, info from the board
+        :param detail: dict, info from the detail page
+        """
+        row = record_row(crawl_id, idx, board, detail)
+        self.query(self.record_sql, row)
+        if self.rollup:
+            self.query(self.rollup_sql, rollup_row(row))
+
+    def add_detail(self, detail_hash, qid, first_seen, raw):
+        """
+        Store a question detail by its hash, if it is not stored yet
+
+        :param detail_hash: SHA-1 of `raw`
+        :param qid: Question ID
+        :param first_seen: the time the detail is fetched
+        :param raw: the question detail
+        """
+        self.query(self.detail_sql, (detail_hash, qid, first_seen, raw))
+
+    def add_metrics(self, crawl_id, summary):
+        """
+        Store the metrics summary of a crawl
+
+        :param crawl_id: Crawl ID
+        :param summary: the summary in JSON
+        """
+        self.query(self.metrics_sql, (crawl_id, summary))
+
+    def follow(self, qids, added):
+        """
+        Add questions to the watchlist, skipping the followed ones
+
+        :param qids: Question IDs
+        :param added: the time they are added, also when they are first due
+        """
+        with self.transaction() as (conn, cur):
+            cur.executemany(self.follow_sql, [(int(qid), added, added) for qid in qids])
+            conn.commit()
+
+    def load_watchlist(self) -> list:
+        """
+        :return: the rows of `watchlist`
+        """
+        return self.query("SELECT * FROM `watchlist`;", None, lambda x: x.fetchall())
+
+    def save_polls(self, states, deltas):
+        """
+        Save the watchlist states after a round of polls, and the counter deltas seen, in one transaction
+
+        :param states: tuples in the column order of `poll_sql`
+        :param deltas: tuples in the column order of `delta_sql`
+        """
+        with self.transaction() as (conn, cur):
+            if states:
+                cur.executemany(self.poll_sql, states)
+            if deltas:
+                cur.executemany(self.delta_sql, deltas)
+            conn.commit()
+
+    def insert_records(self, conn, cur, rows):
+        """
+        Insert record rows with one multi-row `executemany`, without committing.
+        If the batch is rejected, it is rolled back and the rows are inserted one by one,
+        so only the offending rows are lost.
+
+        :param conn: the connection holding the transaction
+        :param cur: a cursor of `conn`
+        :param rows: record rows from `record_row`
+        :return: the rows inserted
+        """
+        if not rows:
+            return rows
+        try:
+            cur.executemany(self.record_sql, rows)
+            return rows
+        except self.broken_errors:
+            raise
+        except self.rejected_errors as e:
+            logger.warning(f"Batch of {len(rows)} records rejected ({e}), inserting row by row")
+            conn.rollback()
+        inserted = []
+        for row in rows:
+            try:
+                cur.execute(self.record_sql, row)
+                inserted.append(row)
+            except self.broken_errors:
+                raise
+            except self.rejected_errors as e:
+                logger.error(f"Exception when adding entry {e} @ qid {row[0]} ranking {row[10]}")
+        return inserted
+
+
+class MySQLStorage(Storage):
+    placeholder = "%s"
+    begin_sql = """
+INSERT INTO crawl (begin) VALUES(%s);
+"""
+    end_sql = """
+UPDATE crawl SET end = %s WHERE id = %s;
+"""
+    record_sql = """
+INSERT INTO record (`qid`, `crawl_id`, `title`, `heat`, `created`, `visitCount`, `followerCount`, `answerCount`,`excerpt`, `raw`, `ranking`, `hit_at`, `url`, `detail_hash`, `heat_value`)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+"""
+    rollup_sql = """
+INSERT INTO question_rollup (`qid`, `title`, `first_seen`, `last_seen`, `peak_rank`, `peak_heat`)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    `title` = VALUES(`title`),
+    `first_seen` = LEAST(`first_seen`, VALUES(`first_seen`)),
+    `last_seen` = GREATEST(`last_seen`, VALUES(`last_seen`)),
+    `peak_rank` = LEAST(`peak_rank`, VALUES(`peak_rank`)),
+    `peak_heat` = GREATEST(COALESCE(`peak_heat`, 0), COALESCE(VALUES(`peak_heat`), 0)),
+    `hits` = `hits` + 1;
+"""
+    detail_sql = """
+INSERT IGNORE INTO question_detail (`hash`, `qid`, `first_seen`, `raw`) VALUES (%s, %s, %s, %s);
+"""
+    metrics_sql = """
+REPLACE INTO crawl_metrics (`crawl_id`, `summary`) VALUES (%s, %s);
+"""
+    checkpoint_sql = """
+REPLACE INTO crawl_checkpoint (`crawl_id`, `board`, `updated`) VALUES (%s, %s, %s);
+"""
+    follow_sql = """
+INSERT IGNORE INTO watchlist (`qid`, `added`, `next_at`) VALUES (%s, %s, %s);
+"""
+    poll_sql = """
+UPDATE watchlist SET `next_at` = %s, `last_hit` = %s, `last_change` = %s, `visitCount` = %s, `followerCount` = %s,
+    `answerCount` = %s, `growth` = %s
+WHERE `qid` = %s;
+"""
+    delta_sql = """
+INSERT IGNORE INTO question_delta (`qid`, `hit_at`, `visit_delta`, `follower_delta`, `answer_delta`) VALUES (%s, %s, %s, %s, %s);
+"""
+    broken_errors = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+    rejected_errors = pymysql.err.DatabaseError
+
+    def __init__(self, pool: ConnectionPool, rollup=False):
+        """
+        Store the crawls in a MySQL server
+
+        :param pool: the pool of connections to the server
+        :param rollup: maintain `question_rollup` when adding entries
+        """
+        super().__init__(rollup)
+        self.pool = pool
+
+    def query(self, sql, args=None, op=None):
+        """
+        Execute an SQL query
+
+        :param sql: the SQL query to execute
+        :param args: the arguments in the query
+        :param op: the operation to cursor after query
+        :return: op(cur)
+        """
+        if args and not (isinstance(args, tuple) or isinstance(args, list)):
+            args = (args,)
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute(sql, args)
+                    conn.commit()
+                    if op is not None:
+                        return op(cur)
+                except:  # Log query then exit
+                    if hasattr(cur, "_last_executed"):
+                        logger.error("Exception @ " + cur._last_executed)
+                    else:
+                        logger.error("Exception @ " + sql)
+                    raise
+
+    @contextmanager
+    def transaction(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                yield conn, cur
+
+    def close(self):
+        self.pool.close()
+
+    def create_table(self):
+        """
+        Create tables to store the hot question records and crawl records
+
+        """
+        sql = """
+CREATE TABLE IF NOT EXISTS `crawl` (
+    `id` BIGINT NOT NULL AUTO_INCREMENT,
+    `begin` DOUBLE NOT NULL,
+    `end` DOUBLE,
+    PRIMARY KEY (`id`) USING BTREE
+)
+AUTO_INCREMENT = 1 
+CHARACTER SET = utf8mb4 
+COLLATE = utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `record`  (
+    `id` BIGINT NOT NULL AUTO_INCREMENT,
+    `qid` INT NOT NULL,
+    `crawl_id` BIGINT NOT NULL,
+    `hit_at` DOUBLE,
+    `ranking` INT NOT NULL,
+    `title` VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL ,
+    `heat` VARCHAR(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    `created` INT,
+    `visitCount` INT,
+    `followerCount` INT,
+    `answerCount` INT,
+    `excerpt` LONGTEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+    `raw` LONGTEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci ,
+    `url` VARCHAR(255),
+    `detail_hash` CHAR(40),
+    `heat_value` BIGINT,
+    PRIMARY KEY (`id`) USING BTREE,
+    INDEX `CrawlAssociation` (`crawl_id`) USING BTREE,
+    INDEX `CrawlRanking` (`crawl_id`, `ranking`) USING BTREE,
+    INDEX `QuestionTimeline` (`qid`, `hit_at`) USING BTREE,
+    CONSTRAINT `CrawlAssociationFK` FOREIGN KEY (`crawl_id`) REFERENCES `crawl` (`id`)
+) 
+AUTO_INCREMENT = 1 
+CHARACTER SET = utf8mb4 
+COLLATE = utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `question_detail` (
+    `hash` CHAR(40) NOT NULL,
+    `qid` INT NOT NULL,
+    `first_seen` DOUBLE,
+    `raw` LONGTEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+    PRIMARY KEY (`hash`) USING BTREE
+)
+CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `question_rollup` (
+    `qid` INT NOT NULL,
+    `title` VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    `first_seen` DOUBLE NOT NULL,
+    `last_seen` DOUBLE NOT NULL,
+    `peak_rank` INT NOT NULL,
+    `peak_heat` BIGINT,
+    `hits` INT NOT NULL DEFAULT 1,
+    PRIMARY KEY (`qid`) USING BTREE
+)
+CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `crawl_metrics` (
+    `crawl_id` BIGINT NOT NULL,
+    `summary` TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    PRIMARY KEY (`crawl_id`) USING BTREE
+)
+CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `crawl_checkpoint` (
+    `crawl_id` BIGINT NOT NULL,
+    `board` LONGTEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
+    `updated` DOUBLE NOT NULL,
+    PRIMARY KEY (`crawl_id`) USING BTREE
+)
+CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `watchlist` (
+    `qid` INT NOT NULL,
+    `added` DOUBLE NOT NULL,
+    `next_at` DOUBLE NOT NULL,
+    `last_hit` DOUBLE,
+    `last_change` DOUBLE,
+    `visitCount` INT,
+    `followerCount` INT,
+    `answerCount` INT,
+    `growth` DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (`qid`) USING BTREE
+);
+
+CREATE TABLE IF NOT EXISTS `question_delta` (
+    `qid` INT NOT NULL,
+    `hit_at` DOUBLE NOT NULL,
+    `visit_delta` INT NOT NULL,
+    `follower_delta` INT NOT NULL,
+    `answer_delta` INT NOT NULL,
+    PRIMARY KEY (`qid`, `hit_at`) USING BTREE
+);
+
+"""
+        self.query(sql)
+        self.add_column("record", "detail_hash", "CHAR(40)")
+        if self.add_column("record", "heat_value", "BIGINT"):
+            # Backfill the usual 'xx 万热度' form, new rows are parsed by `parse_heat`
+            self.query("""
+UPDATE record SET heat_value = CAST(REPLACE(REPLACE(heat, ' ', ''), '万热度', '') AS DECIMAL(20, 2)) * 10000
+WHERE heat LIKE '%万热度';
+""")
+        self.add_index("record", "CrawlRanking", "`crawl_id`, `ranking`")
+        self.add_index("record", "QuestionTimeline", "`qid`, `hit_at`")
+
+    def add_column(self, table, column, definition):
+        """
+        Add a column to a table if it is missing, for tables created by an older version
+
+        :param table: table name
+        :param column: column name
+        :param definition: column definition, e.g. "CHAR(40)"
+        :return: True if the column is added
+        """
+        sql = """
+SELECT COUNT(*) AS cnt FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s;
+"""
+        if self.query(sql, (table, column), lambda x: x.fetchone()["cnt"]):
+            return False
+        logger.info(f"Add column {column} to table {table}")
+        self.query(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition};")
+        return True
+
+    def add_index(self, table, index, columns):
+        """
+        Add an index to a table if it is missing, for tables created by an older version
+
+        :param table: table name
+        :param index: index name
+        :param columns: the indexed columns, e.g. "`qid`, `hit_at`"
+        """
+        sql = """
+SELECT COUNT(*) AS cnt FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s;
+"""
+        if not self.query(sql, (table, index), lambda x: x.fetchone()["cnt"]):
+            logger.info(f"Add index {index} to table {table}, it can take a while...")
+            self.query(f"ALTER TABLE `{table}` ADD INDEX `{index}` ({columns}) USING BTREE;")
+
+
+class SQLiteStorage(Storage):
+    placeholder = "?"
+    begin_sql = """
+INSERT INTO crawl (`begin`) VALUES(?);
+"""
+    end_sql = """
+UPDATE crawl SET `end` = ? WHERE id = ?;
+"""
+    record_sql = """
+INSERT INTO record (`qid`, `crawl_id`, `title`, `heat`, `created`, `visitCount`, `followerCount`, `answerCount`,`excerpt`, `raw`, `ranking`, `hit_at`, `url`, `detail_hash`, `heat_value`)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+    rollup_sql = """
+INSERT INTO question_rollup (`qid`, `title`, `first_seen`, `last_seen`, `peak_rank`, `peak_heat`)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (`qid`) DO UPDATE SET
+    `title` = excluded.`title`,
+    `first_seen` = MIN(`first_seen`, excluded.`first_seen`),
+    `last_seen` = MAX(`last_seen`, excluded.`last_seen`),
+    `peak_rank` = MIN(`peak_rank`, excluded.`peak_rank`),
+    `peak_heat` = MAX(COALESCE(`peak_heat`, 0), COALESCE(excluded.`peak_heat`, 0)),
+    `hits` = `hits` + 1;
+"""
+    detail_sql = """
+INSERT OR IGNORE INTO question_detail (`hash`, `qid`, `first_seen`, `raw`) VALUES (?, ?, ?, ?);
+"""
+    metrics_sql = """
+INSERT OR REPLACE INTO crawl_metrics (`crawl_id`, `summary`) VALUES (?, ?);
+"""
+    checkpoint_sql = """
+INSERT OR REPLACE INTO crawl_checkpoint (`crawl_id`, `board`, `updated`) VALUES (?, ?, ?);
+"""
+    follow_sql = """
+INSERT OR IGNORE INTO watchlist (`qid`, `added`, `next_at`) VALUES (?, ?, ?);
+"""
+    poll_sql = """
+UPDATE watchlist SET `next_at` = ?, `last_hit` = ?, `last_change` = ?, `visitCount` = ?, `followerCount` = ?,
+    `answerCount` = ?, `growth` = ?
+WHERE `qid` = ?;
+"""
+    delta_sql = """
+INSERT OR IGNORE INTO question_delta (`qid`, `hit_at`, `visit_delta`, `follower_delta`, `answer_delta`) VALUES (?, ?, ?, ?, ?);
+"""
+    broken_errors = (sqlite3.OperationalError, sqlite3.InterfaceError)
+    rejected_errors = sqlite3.DatabaseError
+
+    def __init__(self, path, rollup=False):
+        """
+        Store the crawls in a local SQLite file in WAL mode, with one connection per thread
+
+        :param path: the database file
+        :param rollup: maintain `question_rollup` when adding entries
+        """
+        super().__init__(rollup)
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        :return: the connection of the current thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA synchronous = NORMAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def query(self, sql, args=None, op=None):
+        """
+        Execute an SQL query
+
+        :param sql: the SQL query to execute
+        :param args: the arguments in the query
+        :param op: the operation to cursor after query
+        :return: op(cur)
+        """
+        if args and not (isinstance(args, tuple) or isinstance(args, list)):
+            args = (args,)
+        with self.transaction() as (conn, cur):
+            try:
+                cur.execute(sql, args or ())
+                conn.commit()
+                if op is not None:
+                    return op(cur)
+            except:  # Log query then exit
+                logger.error(f"Exception @ {sql} {args}")
+                raise
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        cur = conn.cursor()
+        try:
+            yield conn, cur
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+    def create_table(self):
+        """
+        Create tables to store the hot question records and crawl records
+
+        """
+        sql = """
+CREATE TABLE IF NOT EXISTS `crawl` (
+    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `begin` REAL NOT NULL,
+    `end` REAL
+);
+
+CREATE TABLE IF NOT EXISTS `record` (
+    `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `qid` INTEGER NOT NULL,
+    `crawl_id` INTEGER NOT NULL REFERENCES `crawl` (`id`),
+    `hit_at` REAL,
+    `ranking` INTEGER NOT NULL,
+    `title` TEXT NOT NULL,
+    `heat` TEXT NOT NULL,
+    `created` INTEGER,
+    `visitCount` INTEGER,
+    `followerCount` INTEGER,
+    `answerCount` INTEGER,
+    `excerpt` TEXT,
+    `raw` TEXT,
+    `url` TEXT,
+    `detail_hash` TEXT,
+    `heat_value` INTEGER
+);
+CREATE INDEX IF NOT EXISTS `CrawlAssociation` ON `record` (`crawl_id`);
+CREATE INDEX IF NOT EXISTS `CrawlRanking` ON `record` (`crawl_id`, `ranking`);
+CREATE INDEX IF NOT EXISTS `QuestionTimeline` ON `record` (`qid`, `hit_at`);
+
+CREATE TABLE IF NOT EXISTS `question_detail` (
+    `hash` TEXT PRIMARY KEY,
+    `qid` INTEGER NOT NULL,
+    `first_seen` REAL,
+    `raw` TEXT
+);
+
+CREATE TABLE IF NOT EXISTS `question_rollup` (
+    `qid` INTEGER PRIMARY KEY,
+    `title` TEXT NOT NULL,
+    `first_seen` REAL NOT NULL,
+    `last_seen` REAL NOT NULL,
+    `peak_rank` INTEGER NOT NULL,
+    `peak_heat` INTEGER,
+    `hits` INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS `crawl_metrics` (
+    `crawl_id` INTEGER PRIMARY KEY,
+    `summary` TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS `crawl_checkpoint` (
+    `crawl_id` INTEGER PRIMARY KEY,
+    `board` TEXT NOT NULL,
+    `updated` REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS `watchlist` (
+    `qid` INTEGER PRIMARY KEY,
+    `added` REAL NOT NULL,
+    `next_at` REAL NOT NULL,
+    `last_hit` REAL,
+    `last_change` REAL,
+    `visitCount` INTEGER,
+    `followerCount` INTEGER,
+    `answerCount` INTEGER,
+    `growth` REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS `question_delta` (
+    `qid` INTEGER NOT NULL,
+    `hit_at` REAL NOT NULL,
+    `visit_delta` INTEGER NOT NULL,
+    `follower_delta` INTEGER NOT NULL,
+    `answer_delta` INTEGER NOT NULL,
+    PRIMARY KEY (`qid`, `hit_at`)
+) WITHOUT ROWID;
+"""
+        self.connection().executescript(sql)
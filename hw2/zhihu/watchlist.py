@@ -0,0 +1,179 @@
+import argparse
+import heapq
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from logs import setup_logging
+from zhihu import ZhihuCrawler
+
+logger = logging.getLogger()
+
+counters = ("visitCount", "followerCount", "answerCount")
+
+
+class Watchlist:
+    def __init__(self, crawler: ZhihuCrawler, options=None):
+        """
+        Poll followed questions with `get_question`, each at its own pace. A question is due again after
+        a share (`backoff`) of the time since its counters last changed, but no later than when its
+        recent growth rate should have moved its visits by `target_growth`, within
+        [`min_interval`, `max_interval`]. Only the changes of the counters are stored, in `question_delta`.
+
+        :param crawler: the crawler to fetch with, sharing its storage and rate limiter
+        :param options: the "watchlist" settings
+        """
+        options = options or {}
+        self.crawler = crawler
+        self.storage = crawler.storage
+        self.min_interval = options.get("min_interval", 600)
+        self.max_interval = options.get("max_interval", 86400)
+        self.backoff = options.get("backoff", 0.5)
+        self.target_growth = options.get("target_growth", 0.01)
+        self.batch = options.get("batch", 100)
+        self.workers = options.get("workers", crawler.settings["config"].get("question_workers", 1))
+        self.state = {}  # qid -> the row in `watchlist`
+        self.heap = []  # (next_at, qid), one entry for each followed question
+        self.validators = {}  # qid -> validators of the last response, kept in memory only
+
+    def load(self):
+        """
+        Load the followed questions from the storage
+
+        """
+        self.state = {row["qid"]: dict(row) for row in self.storage.load_watchlist()}
+        self.heap = [(state["next_at"], qid) for qid, state in self.state.items()]
+        heapq.heapify(self.heap)
+        logger.info(f"Watching {len(self.state)} questions")
+
+    def follow(self, qids):
+        """
+        Follow questions, which are due at once
+
+        :param qids: Question IDs
+        """
+        now = time.time()
+        qids = [int(qid) for qid in qids if int(qid) not in self.state]
+        self.storage.follow(qids, now)
+        for qid in qids:
+            self.state[qid] = {"qid": qid, "added": now, "next_at": now, "last_hit": None, "last_change": None,
+                               "visitCount": None, "followerCount": None, "answerCount": None, "growth": 0}
+            heapq.heappush(self.heap, (now, qid))
+
+    def interval(self, state, now) -> float:
+        """
+        :param state: the state of a question after a poll
+        :param now: the time of the poll
+        :return: seconds until the question is due again
+        """
+        wait = (now - (state["last_change"] or state["added"])) * self.backoff
+        if state["growth"] > 0:
+            wait = min(wait, self.target_growth / state["growth"])
+        return min(self.max_interval, max(self.min_interval, wait))
+
+    def poll(self, qid):
+        """
+        Fetch a question and update its state
+
+        :param qid: Question ID
+        :return: (the new state, the counter deltas or None if nothing changed)
+        """
+        state = dict(self.state[qid])
+        self.crawler.limiter.acquire()
+        try:
+            detail = self.crawler.get_question(qid, self.validators.get(qid))
+        except Exception as e:
+            if len(e.args) > 0 and isinstance(e.args[0], requests.Response):
+                logger.warning(f"Polling question {qid} failed: {e.args[0].status_code}")
+            else:
+                logger.warning(f"Polling question {qid} failed: {e!r}")
+            state["next_at"] = time.time() + self.interval(state, time.time())
+            return state, None
+
+        now = time.time()
+        delta = None
+        if detail is not None:  # Otherwise not modified
+            self.validators[qid] = detail["validators"]
+            new = {name: detail[name] if detail[name] is not None else state[name] for name in counters}
+            # The first delta is taken from zero, so the deltas of a question add up to its counters
+            delta = tuple((new[name] or 0) - (state[name] or 0) for name in counters)
+            if any(delta):
+                if state["last_hit"] is not None and state["visitCount"]:
+                    growth = delta[0] / state["visitCount"] / max(now - state["last_hit"], 1)
+                    state["growth"] = (state["growth"] + growth) / 2
+                state["last_change"] = now
+                state.update(new)
+            else:
+                delta = None
+        if delta is None:
+            state["growth"] /= 2  # Quiet questions slow down
+        state["last_hit"] = now
+        state["next_at"] = now + self.interval(state, now)
+        return state, delta
+
+    def run_once(self, executor, now) -> int:
+        """
+        Poll up to `batch` due questions and save the results
+
+        :return: the number of questions polled
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < self.batch:
+            due.append(heapq.heappop(self.heap)[1])
+        if not due:
+            return 0
+        states, deltas = [], []
+        for qid, (state, delta) in zip(due, executor.map(self.poll, due)):
+            self.state[qid] = state
+            heapq.heappush(self.heap, (state["next_at"], qid))
+            states.append((state["next_at"], state["last_hit"], state["last_change"], state["visitCount"],
+                           state["followerCount"], state["answerCount"], state["growth"], qid))
+            if delta is not None:
+                deltas.append((qid, state["last_hit"]) + delta)
+        self.storage.save_polls(states, deltas)
+        stats = self.crawler.stats.summary()  # The requests of this round
+        logger.info(f"Polled {len(due)} questions, {len(deltas)} changed, {len(self.heap)} watched; "
+                    f"{stats['requests']} requests, {stats['bytes'] / 1024:.1f} KB, {stats['mean_seconds']:.3f} s mean")
+        return len(due)
+
+    def run(self, stop):
+        """
+        Poll the due questions until stopped
+
+        :param stop: an event to stop on
+        """
+        with ThreadPoolExecutor(max(1, self.workers), thread_name_prefix="watch") as executor:
+            while not stop.is_set():
+                now = time.time()
+                if self.run_once(executor, now) == 0:
+                    stop.wait(min(self.heap[0][0] - now, 60) if self.heap else 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow questions and poll them over time")
+    parser.add_argument("action", choices=("follow", "run"))
+    parser.add_argument("qids", nargs="*", help="Question IDs to follow")
+    parser.add_argument("--board", action="store_true", help="follow every question recorded from the board")
+    args = parser.parse_args()
+
+    with open("zhihu.json", "r", encoding="utf8") as f:
+        settings = json.load(f)
+    setup_logging(settings.get("logging"))
+    crawler = ZhihuCrawler(settings)
+    crawler.create_table()
+    watchlist = Watchlist(crawler, settings.get("watchlist"))
+    watchlist.load()
+    if args.action == "follow":
+        qids = list(args.qids)
+        if args.board:
+            qids += [row["qid"] for row in crawler.query("SELECT DISTINCT `qid` FROM `record`;", None, lambda x: x.fetchall())]
+        watchlist.follow(qids)
+        print(f"Watching {len(watchlist.state)} questions")
+    else:
+        stop = threading.Event()
+        try:
+            watchlist.run(stop)
+        except KeyboardInterrupt:
+            logger.info("Stopping ...")
@@ -1,35 +1,180 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-import pymysql
 from bs4 import BeautifulSoup as BS
 import logging
 import time
-import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from initial_data import extract_question
+import board
+from storage import make_storage, record_row
+from adaptive import AdaptiveScheduler
+import metrics
+from logs import setup_logging
 
-fmt = '%(asctime)s.%(msecs)03d [%(levelname)s] %(message)s'
-datefmt = '%Y-%m-%d %H:%M:%S'
-level = logging.INFO
-
-formatter = logging.Formatter(fmt, datefmt)
 logger = logging.getLogger()
-logger.setLevel(level)
+setup_logging()  # Reconfigured with the "logging" settings when run as a script
 
-file = logging.FileHandler("../zhihu.log", encoding='utf-8')
-file.setLevel(level)
-file.setFormatter(formatter)
-logger.addHandler(file)
 
-console = logging.StreamHandler()
-console.setLevel(level)
-console.setFormatter(formatter)
-logger.addHandler(console)
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        """
+        A token bucket shared by threads. Tokens are refilled at `rate` per second, up to `burst`
 
+        :param rate: the average number of acquisitions allowed per second
+        :param burst: the maximum number of acquisitions allowed at once
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
 
-class ZhihuCrawler:
+    def acquire(self):
+        """
+        Block until a token is available, then take it
+
+        """
+        while True:
+            wait = self.reserve()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def reserve(self) -> float:
+        """
+        Take a token if one is available, without blocking
+
+        :return: 0 if a token is taken, otherwise the seconds to wait before trying again
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class RequestStats:
     def __init__(self):
-        with open("zhihu.json", "r", encoding="utf8") as f:
-            self.settings = json.load(f)  # Load settings
-        logger.info("Settings loaded")
+        """
+        Running totals of the latency and size of the HTTP requests since the last `summary`,
+        kept in constant memory however long no summary is taken
+
+        """
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.requests = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, url, status, seconds, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def summary(self, reset=True) -> dict:
+        """
+        Summarize the recorded requests
+
+        :param reset: start the totals over after summarizing
+        :return: dict of request count, total bytes, total / mean / max latency
+        """
+        with self._lock:
+            summary = {
+                "requests": self.requests,
+                "bytes": self.bytes,
+                "seconds": self.seconds,
+                "mean_seconds": self.seconds / self.requests if self.requests else 0,
+                "max_seconds": self.max_seconds,
+            }
+            if reset:
+                self._reset()
+        return summary
+
+
+class ZhihuCrawler:
+    def __init__(self, settings=None):
+        """
+        :param settings: the settings in the form of zhihu.json, loaded from zhihu.json if not given
+        """
+        if settings is None:
+            with open("zhihu.json", "r", encoding="utf8") as f:
+                settings = json.load(f)  # Load settings
+            logger.info("Settings loaded")
+        self.settings = settings
+        config = self.settings["config"]
+        self.storage = make_storage(self.settings)
+        self.limiter = RateLimiter(config.get("question_rate", 0.5), config.get("question_burst", 1))
+        self.session = self.make_session()
+        self.stats = RequestStats()
+        self.detail_cache = {}  # qid -> the last detail without `raw`, used by `refresh_question`
+        self.scheduler = None  # Adapts the board interval and picks the entries to refresh, if configured
+        if config.get("adaptive", False):
+            self.scheduler = AdaptiveScheduler(
+                config["interval_between_board"],
+                config.get("min_interval_between_board", 60),
+                config.get("max_interval_between_board", 1800),
+                config.get("target_churn", 0.2),
+                config.get("refresh_heat_threshold", 0.05),
+            )
+
+    def make_session(self) -> requests.Session:
+        """
+        Create the long-lived HTTP session, which keeps connections alive and
+        retries with backoff on 429 and 5xx responses
+
+        :return: the session, carrying the headers in the settings
+        """
+        config = self.settings["config"]
+        retry = Retry(
+            total=config.get("http_retries", 3),
+            backoff_factor=config.get("http_backoff", 1),
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=config.get("http_pool_size", 8),
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.settings["headers"])
+        return session
+
+    def fetch(self, url, headers=None) -> requests.Response:
+        """
+        GET a page with the session, recording its latency and size
+
+        :param url: the page URL
+        :param headers: extra headers of this request, e.g. validators of a conditional request
+        :return: the response
+        :raise RuntimeError: with the response as its argument, if the status code is not 200,
+                             or 304 for a conditional request
+        """
+        begin = time.perf_counter()
+        res = self.session.get(url, headers=headers, timeout=self.settings["config"].get("http_timeout", 10))
+        size = len(res.content)
+        seconds = time.perf_counter() - begin
+        self.stats.record(url, res.status_code, seconds, size)
+        metrics.stage_seconds.observe(seconds, stage="fetch")
+        metrics.requests_total.inc(status=res.status_code)
+        if res.status_code != 200 and not (headers and res.status_code == 304):
+            raise RuntimeError(res)
+        return res
 
 
     def sleep(self, sleep_key, delta=0):
@@ -40,39 +185,25 @@ class ZhihuCrawler:
         :param delta: added to the sleep time
         :return:
         """
-        _t = self.settings["config"][sleep_key] + delta
-        logger.info(f"Sleep {_t} second(s)")
-        time.sleep(_t)
+        if sleep_key == "interval_between_board" and self.scheduler is not None:
+            _t = self.scheduler.interval + delta
+        else:
+            _t = self.settings["config"][sleep_key] + delta
+        _t = max(0, _t)
+        logger.info(f"Sleep {_t} second(s)", extra={"sample": sleep_key == "interval_between_question"})
+        with metrics.stage_seconds.time(stage="sleep"):
+            time.sleep(_t)
 
     def query(self, sql, args=None, op=None):
         """
-        Execute an SQL query
+        Execute an SQL query on the storage backend
 
-        :param sql: the SQL query to execute
+        :param sql: the SQL query to execute, in the parameter style of the backend
         :param args: the arguments in the query
         :param op: the operation to cursor after query
         :return: op(cur)
         """
-        conn = pymysql.connect(
-            cursorclass=pymysql.cursors.DictCursor,
-            client_flag=pymysql.constants.CLIENT.MULTI_STATEMENTS,
-            **self.settings['mysql']
-        )
-        if args and not (isinstance(args, tuple) or isinstance(args, list)):
-            args = (args,)
-        with conn:
-            with conn.cursor() as cur:
-                try:
-                    cur.execute(sql, args)
-                    conn.commit()
-                    if op is not None:
-                        return op(cur)
-                except:  # Log query then exit
-                    if hasattr(cur, "_last_executed"):
-                        logger.error("Exception @ " + cur._last_executed)
-                    else:
-                        logger.error("Exception @ " + sql)
-                    raise
+        return self.storage.query(sql, args, op)
 
     def watch(self, top=None):
         """
@@ -82,120 +213,247 @@ class ZhihuCrawler:
         :return:
         """
         self.create_table()
+        port = self.settings["config"].get("metrics_port")
+        if port:
+            metrics.serve(port)
+        scheduled = None
         while True:
-            logger.info("Begin crawling ...")
-            try:
-                crawl_id = None
-                begin_time = time.time()
-                crawl_id = self.begin_crawl(begin_time)
+            begin_time = time.time()
+            if scheduled is not None:
+                metrics.crawl_lag_seconds.set(max(0, begin_time - scheduled))
+            self.crawl(top)
+            self.sleep("interval_between_board", delta=(begin_time - time.time()))
+            scheduled = begin_time + (self.scheduler.interval if self.scheduler is not None
+                                      else self.settings["config"]["interval_between_board"])
 
+    def crawl(self, top=None):
+        """
+        Crawl the board and the questions on it once
+
+        :param top: only look at the first `top` entries in the board
+        :return: Crawl ID, or None if the crawl stopped on an exception
+        """
+        logger.info("Begin crawling ...")
+        crawl_id = None
+        begin = time.perf_counter()
+        before = metrics.registry.snapshot()
+        checkpoint = self.settings["config"].get("checkpoint", False)
+        try:
+            resumed = self.resume_crawl() if checkpoint else None
+            if resumed is not None:
+                crawl_id, board_entries, finished = resumed
+                logger.info(f"Resume crawl {crawl_id}: {len(finished)} of {len(board_entries)} entries finished")
+            else:
+                crawl_id = self.begin_crawl(time.time())
                 try:
                     board_entries = self.get_board()
-                except RuntimeError as e:
-                    if isinstance(e.args[0], requests.Response):
-                        logger.exception(e.args[0].status_code, e.args[0].text)
+                except Exception as e:
+                    if isinstance(e, RuntimeError) and isinstance(e.args[0], requests.Response):
+                        logger.exception(f"{e.args[0].status_code}; {e.args[0].text}")
+                    if checkpoint:  # Nothing to resume without the board
+                        self.end_crawl(crawl_id)
                     raise
                 else:
-                    logger.info(
-                        f"Get {len(board_entries)} items: {','.join(map(lambda x: x['title'][:20], board_entries))}")
+                    logger.info(f"Get {len(board_entries)} items")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Items: {','.join(map(lambda x: x['title'][:20], board_entries))}")
                 if top:
                     board_entries = board_entries[:top]
+                if checkpoint:
+                    self.storage.save_checkpoint(crawl_id, board_entries)
+                finished = set()
+            if self.scheduler is not None:
+                churn = self.scheduler.observe(board_entries)
+                logger.info(
+                    f"Crawl {crawl_id} churn {churn['churn']:.3f} (new {churn['new_ratio']:.2f}, "
+                    f"rank move {churn['rank_move']:.2f}, heat change {churn['heat_change']:.3f}), "
+                    f"refresh {churn['refresh']}/{churn['entries']}, next interval {churn['interval']:.0f} s")
+
+            # Buffer the records of this crawl so they are written in one transaction
+            rows = [] if self.settings["config"].get("batch_write", False) else None
+
+            # Process each entry in the hot list, except those finished before a restart
+            pending = [(idx, item) for idx, item in enumerate(board_entries) if idx not in finished]
+            for (idx, item), detail in zip(pending, self.iter_details(crawl_id, pending)):
+                try:
+                    if rows is None:
+                        self.add_entry(crawl_id, idx, item, detail)
+                    else:
+                        rows.append(record_row(crawl_id, idx, item, detail))
+                        if checkpoint and len(rows) >= self.settings["config"].get("checkpoint_every", 10):
+                            with metrics.stage_seconds.time(stage="db"):
+                                self.storage.flush_records(crawl_id, rows)
+                            rows = []
+                except Exception as e:
+                    logger.exception(f"Exception when adding entry {e}")
+            self.end_crawl(crawl_id, rows)
+            if checkpoint:
+                self.storage.drop_checkpoint(crawl_id)
+            stats = self.stats.summary()
+            logger.info(
+                f"Crawl {crawl_id} made {stats['requests']} requests, {stats['bytes'] / 1024:.1f} KB, "
+                f"{stats['seconds']:.2f} s in total, {stats['mean_seconds']:.3f} s mean, {stats['max_seconds']:.3f} s max")
+        except Exception as e:
+            logger.exception(f"Crawl {crawl_id} encountered an exception {e}. This crawl stopped.")
+            metrics.crawls_total.inc(result="failed")
+            return None
+        metrics.crawls_total.inc(result="ok")
+        metrics.crawl_seconds.observe(time.perf_counter() - begin)
+        if self.settings["config"].get("metrics_summary", False):
+            self.add_metrics(crawl_id, before)
+        return crawl_id
+
+    def add_metrics(self, crawl_id, before):
+        """
+        Store what the metrics gained during a crawl as a JSON row in `crawl_metrics`
 
-                # Process each entry in the hot list
-                for idx, item in enumerate(board_entries):
+        :param crawl_id: Crawl ID
+        :param before: `metrics.registry.snapshot()` at the beginning of the crawl
+        """
+        summary = metrics.diff(before, metrics.registry.snapshot())
+        try:
+            self.storage.add_metrics(crawl_id, json.dumps(summary))
+        except Exception as e:
+            logger.exception(f"Exception when adding metrics of crawl {crawl_id} {e}")
+
+    def resume_crawl(self):
+        """
+        Find the crawl to resume from its checkpoint. The crawls whose checkpoints are older than
+        `checkpoint_timeout` seconds are given up, and ended at the time of their last checkpoint;
+        the open crawls older than that without a checkpoint are ended at their beginning time
+
+        :return: (Crawl ID, the board entries, the rankings finished), or None if there is nothing to resume
+        """
+        timeout = self.settings["config"].get("checkpoint_timeout", 3600)
+        for crawl_id in self.storage.end_stale_crawls(time.time() - timeout):
+            logger.warning(f"Crawl {crawl_id} stopped before its checkpoint, ended")
+        resumed = None
+        for row in self.storage.open_checkpoints():
+            if row["updated"] < time.time() - timeout:
+                logger.warning(f"Crawl {row['crawl_id']} is stale since {row['updated']}, ending it")
+                self.storage.drop_checkpoint(row["crawl_id"], end=row["updated"])
+            else:
+                resumed = row  # The latest one
+        if resumed is None:
+            return None
+        crawl_id = resumed["crawl_id"]
+        return crawl_id, json.loads(resumed["board"]), self.storage.finished_rankings(crawl_id)
+
+    def iter_details(self, crawl_id, entries):
+        """
+        Fetch the details of the board entries, sequentially or by a pool of
+        `question_workers` threads sharing the rate limiter
+
+        :param crawl_id: Crawl ID
+        :param entries: (ranking, entry) of the entries from `get_board` to fetch
+        :return: an iterator of the details, in the order of `entries`
+        """
+        workers = self.settings["config"].get("question_workers", 1)
+        if workers <= 1:
+            for idx, item in entries:
+                if self.cached_detail(item) is None:
                     self.sleep("interval_between_question")
-                    detail = {
-                        "created": None,
-                        "visitCount": None,
-                        "followerCount": None,
-                        "answerCount": None,
-                        "raw": None,
-                        "hit_at": None
-                    }
-                    if item["qid"] is None:
-                        logger.warning(f"Unparsed URL @ {item['url']} ranking {idx} in crawl {crawl_id}.")
-                    else:
-                        try:
-                            detail = self.get_question(item["qid"])
-                        except Exception as e:
-                            if len(e.args) > 0 and isinstance(e.args[0], requests.Response):
-                                logger.exception(f"{e}; {e.args[0].status_code}; {e.args[0].text}")
-                            else:
-                                logger.exception(f"{str(e)}")
-                        else:
-                            logger.info(f"Get question detail for {item['title']}: raw detail length {len(detail['raw']) if detail['raw'] else 0}")
-                    try:
-                        self.add_entry(crawl_id, idx, item, detail)
-                    except Exception as e:
-                        logger.exception(f"Exception when adding entry {e}")
-                self.end_crawl(crawl_id)
-            except Exception as e:
-                logger.exception(f"Crawl {crawl_id} encountered an exception {e}. This crawl stopped.")
-            self.sleep("interval_between_board", delta=(begin_time - time.time()))
+                yield self.fetch_detail(crawl_id, idx, item)
+            return
+        with ThreadPoolExecutor(workers, thread_name_prefix="question") as executor:
+            yield from executor.map(lambda x: self.fetch_detail(crawl_id, *x, limited=True), entries)
+
+    def fetch_detail(self, crawl_id, idx, item, limited=False):
+        """
+        Fetch the detail of a board entry, logging instead of raising on failure
+
+        :param crawl_id: Crawl ID
+        :param idx: Ranking in the board
+        :param item: dict, info from the board
+        :param limited: wait for the rate limiter before the request
+        :return: dict, info from the detail page, whose values are None on failure
+        """
+        detail = self.empty_detail()
+        if item["qid"] is None:
+            logger.warning(f"Unparsed URL @ {item['url']} ranking {idx} in crawl {crawl_id}.")
+            return detail
+        cached = self.cached_detail(item)
+        if cached is not None:
+            return cached
+        if limited:
+            with metrics.stage_seconds.time(stage="sleep"):
+                self.limiter.acquire()
+        try:
+            detail = self.question_detail(item["qid"])
+        except Exception as e:
+            if len(e.args) > 0 and isinstance(e.args[0], requests.Response):
+                logger.exception(f"{e}; {e.args[0].status_code}; {e.args[0].text}")
+            else:
+                logger.exception(f"{str(e)}")
+        else:
+            logger.info(f"Get question detail for {item['title']}: raw detail length {len(detail['raw']) if detail['raw'] else 0}",
+                        extra={"sample": True})
+        return detail
+
+    def cached_detail(self, item):
+        """
+        :param item: dict, info from the board
+        :return: the last detail of the entry if the adaptive scheduler does not refresh it, otherwise None
+        """
+        if self.scheduler is None or item["qid"] is None or self.scheduler.needs_refresh(item["qid"]):
+            return None
+        cached = self.detail_cache.get(str(item["qid"]))
+        return dict(cached) if cached is not None else None
+
+    @staticmethod
+    def empty_detail() -> dict:
+        """
+        :return: the detail stored when the question page is not available
+        """
+        return {
+            "created": None,
+            "visitCount": None,
+            "followerCount": None,
+            "answerCount": None,
+            "raw": None,
+            "hit_at": None
+        }
+
+    def question_detail(self, qid) -> dict:
+        """
+        Fetch question info, incrementally if configured
+
+        :param qid: Question ID
+        :return: a dict of question info
+        """
+        if self.settings["config"].get("incremental", False):
+            return self.refresh_question(qid)
+        detail = self.get_question(qid)
+        if self.scheduler is not None:  # Reused while its heat holds still, `raw` included for its records
+            self.detail_cache[str(qid)] = dict(detail)
+        return detail
 
     def create_table(self):
         """
         Create tables to store the hot question records and crawl records
 
         """
-        sql = f"""
-CREATE TABLE IF NOT EXISTS `crawl` (
-    `id` BIGINT NOT NULL AUTO_INCREMENT,
-    `begin` DOUBLE NOT NULL,
-    `end` DOUBLE,
-    PRIMARY KEY (`id`) USING BTREE
-)
-AUTO_INCREMENT = 1 
-CHARACTER SET = utf8mb4 
-COLLATE = utf8mb4_unicode_ci;
-
-CREATE TABLE IF NOT EXISTS `record`  (
-    `id` BIGINT NOT NULL AUTO_INCREMENT,
-    `qid` INT NOT NULL,
-    `crawl_id` BIGINT NOT NULL,
-    `hit_at` DOUBLE,
-    `ranking` INT NOT NULL,
-    `title` VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL ,
-    `heat` VARCHAR(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL,
-    `created` INT,
-    `visitCount` INT,
-    `followerCount` INT,
-    `answerCount` INT,
-    `excerpt` LONGTEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
-    `raw` LONGTEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci ,
-    `url` VARCHAR(255),
-    PRIMARY KEY (`id`) USING BTREE,
-    INDEX `CrawlAssociation` (`crawl_id`) USING BTREE,
-    CONSTRAINT `CrawlAssociationFK` FOREIGN KEY (`crawl_id`) REFERENCES `crawl` (`id`)
-) 
-AUTO_INCREMENT = 1 
-CHARACTER SET = utf8mb4 
-COLLATE = utf8mb4_unicode_ci;
-
-"""
-        self.query(sql)
-
-    def begin_crawl(self, begin_time) -> (int, float):
+        self.storage.create_table()
+
+    def begin_crawl(self, begin_time) -> int:
         """
         Mark the beginning of a crawl
-        :param begin_time:
-        :return: (Crawl ID, the time marked when crawl begin)
+
+        :param begin_time: the time marked when crawl begin
+        :return: Crawl ID
         """
-        sql = """
-INSERT INTO crawl (begin) VALUES(%s);
-"""
-        return self.query(sql, begin_time, lambda x: x.lastrowid)
+        with metrics.stage_seconds.time(stage="db"):
+            return self.storage.begin_crawl(begin_time)
 
-    def end_crawl(self, crawl_id: int):
+    def end_crawl(self, crawl_id: int, rows=None):
         """
         Mark the ending time of a crawl
 
         :param crawl_id: Crawl ID
+        :param rows: buffered record rows from `record_row`, inserted in the same transaction
         """
-        sql = """
-UPDATE crawl SET end = %s WHERE id = %s;
-"""
-        self.query(sql, (time.time(), crawl_id))
+        with metrics.stage_seconds.time(stage="db"):
+            self.storage.end_crawl(crawl_id, rows)
 
     def add_entry(self, crawl_id, idx, board, detail):
         """
@@ -206,29 +464,8 @@ UPDATE crawl SET end = %s WHERE id = %s;
         :param board: dict, info from the board
         :param detail: dict, info from the detail page
         """
-        sql = \
-            """
-INSERT INTO record (`qid`, `crawl_id`, `title`, `heat`, `created`, `visitCount`, `followerCount`, `answerCount`,`excerpt`, `raw`, `ranking`, `hit_at`, `url`)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-"""
-        self.query(
-            sql,
-            (
-                board["qid"],
-                crawl_id,
-                board["title"],
-                board["heat"],
-                detail["created"],
-                detail["visitCount"],
-                detail["followerCount"],
-                detail["answerCount"],
-                board["excerpt"],
-                detail["raw"],
-                idx,
-                detail["hit_at"],
-                board["url"]
-            )
-        )
+        with metrics.stage_seconds.time(stage="db"):
+            self.storage.add_entry(crawl_id, idx, board, detail)
 
     def get_board(self) -> list:
         """
@@ -263,38 +500,10 @@ VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
         ]
         """
 
-        url = "https://www.zhihu.com/hot"
-        headers = self.settings["headers"]
-        res = requests.get(url,headers = headers)
-        soup = BS(res.text,'lxml')
-        sections = soup.find_all('section',class_ = "HotItem")
-        question_list=[]
-
-        for i in sections:
-            try:
-                dic = {}
-                dic['url'] = i.find('a')['href']
-                qid_pattern = re.compile('question/(\d+)')
-                m_list = qid_pattern.findall(dic['url'])
-                if m_list:
-                    dic['qid']=m_list[0]
-                else:
-                    continue
-                dic["title"] = i.find('a')['title']
-                excerpt = i.find('p',class_ = "HotItem-excerpt")
-                if excerpt:
-                    dic["excerpt"]=excerpt.txt
-                else:
-                    dic["excerpt"]=None
-                dic['heat'] = i.find('div',class_ = "HotItem-metrics").text
-                heat_pattern = re.compile('.+热度')
-                dic['heat'] = heat_pattern.findall(dic['heat'])[0]
-                question_list.append(dic)
-                # print(len(question_list))
-            except:
-                continue
-
-        return question_list
+        url = self.settings["config"].get("base_url", "https://www.zhihu.com") + "/hot"
+        res = self.fetch(url)
+        with metrics.stage_seconds.time(stage="parse"):
+            return self.parse_board(res.text)
 
         # Hint: - Parse HTML, pay attention to the <section> tag.
         #       - Use keyword argument `class_` to specify the class of a tag in `find`
@@ -302,12 +511,58 @@ VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
 
         # raise NotImplementedError
 
-    def get_question(self, qid: int) -> dict:
+    @staticmethod
+    def parse_board(html) -> list:
+        """
+        Parse the hot question list from the board page
+
+        :param html: the board page
+        :return: hot question list like `get_board`, of `board.BoardEntry`
+        """
+        return board.parse_board(html)
+
+    def refresh_question(self, qid) -> dict:
+        """
+        Fetch question info incrementally. The request is conditional on the validators of the last
+        response, and `raw` is stored in `question_detail` by its hash only when it changes.
+
+        :param qid: Question ID
+        :return: a dict of question info like `get_question`, with `detail_hash`.
+                 `raw` is None if the detail did not change
+        """
+        qid = str(qid)
+        cached = self.detail_cache.get(qid)
+        detail = self.compare_detail(cached, self.get_question(qid, cached["validators"] if cached else None))
+        if detail["raw"] is not None:
+            with metrics.stage_seconds.time(stage="db"):
+                self.storage.add_detail(detail["detail_hash"], qid, detail["hit_at"], detail["raw"])
+        self.detail_cache[qid] = dict(detail, raw=None)
+        return detail
+
+    @staticmethod
+    def compare_detail(cached, detail) -> dict:
+        """
+        Compare a fetched detail with the cached one, by the hash of `raw`
+
+        :param cached: the cached detail, or None
+        :param detail: the result of `get_question` with the validators of `cached`
+        :return: the detail with `detail_hash`, whose `raw` is None unless it is new and should be stored
+        """
+        if detail is None:  # Not modified
+            return dict(cached, hit_at=time.time())
+        if detail["raw"] is not None:
+            detail["detail_hash"] = hashlib.sha1(detail["raw"].encode("utf8")).hexdigest()
+            if cached and cached.get("detail_hash") == detail["detail_hash"]:
+                detail["raw"] = None
+        return detail
+
+    def get_question(self, qid: int, validators=None) -> dict:
         """
         TODO: Fetch question info by question ID
 
         :param qid: Question ID
-        :return: a dict of question info
+        :param validators: headers of a conditional request, from `validators` of a previous result
+        :return: a dict of question info, or None if the question is not modified since `validators`
 
         Return Example:
         {
@@ -331,26 +586,13 @@ VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
         """
 
         qid = str(qid)
-        url = "https://www.zhihu.com/question/" + qid
-        headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36",
-                "Cookie": '_zap=0095d9c6-45e8-4670-93d5-2e164d6876e2; _xsrf=IWDoh8eD3Chb8094wbsSMGu52i6KLKyJ; d_c0="AKBRzNebQRWPTj7xC4fffJ0MrfSmXz2rf2k=|1657960182"; __snaker__id=FjOPfv7h6UdRET2M; _9755xjdesxxd_=32; YD00517437729195%3AWM_NI=Q81WY8%2BGluyLTYAP0xmIW9Vzpiwt%2FNuCg%2F%2BH1ORQGJjoa3LmUw0wtyboCpcqfZNC%2FvuGg1scJuM6BcUJwggrE%2Bi5q2F%2FXV2gXn3vQBrflvdNJNb%2FQH%2F7EpdGqUrRiDJbMWQ%3D; YD00517437729195%3AWM_NIKE=9ca17ae2e6ffcda170e2e6eed4d33e90e9add5c83e96b48eb6c84b868f9bb0d154978ebdb4d149f595e596c82af0fea7c3b92a93e8ffb8dc34e999a496fc4898878fb1b374af9799dad572b4b7b995ae46b79da9d0aa44f3919eb2c642aab1afd4cf6797a90098f773a2b18d91e27ba68682a4ae7eb799a9d2f2698aab83d7c1699796b988e67a87f5a7d6f43a86f198b7b16d9cb2fd97d44ab2baa497e7468a92aed0d444ede98b91e74db38bbeb3ec508abe83b8d437e2a3; YD00517437729195%3AWM_TID=dJvXNiE7GRpEVUVFRBPATRU8WEH7KurB; gdxidpyhxdE=tlWtge%2FiNWQxep4D60%5CnPmQJB7mMLu7U1pKAxvV1s3fLUdjlpwVZ5ug9WDM7y0WAqWSirut%2FoQqqZb6S%5C3U4arV1CA1WIG43rP9ot92IjGN5QPHZxttqeRAYLcN%2F9Q2IX2x%5Ccj9injOvS%2BvRa4eu%2Bomyua30DT%2FpPlyXVaml274QO1%2Fc%3A1657972288657; o_act=login; ref_source=other_https://www.zhihu.com/signin?next=/; auth_type=wechat; token=58_FhYkOGjzMk7j_elv4J6fvBfpuKtT-A78UGfIV4EbtwQJ1w5zAK1BaomCtfBRPpE8lVe4tc2OPgPaV2Mrk868VO8jY7mmE6kdgv6vclpdnfw; atoken=58_FhYkOGjzMk7j_elv4J6fvBfpuKtT-A78UGfIV4EbtwQJ1w5zAK1BaomCtfBRPpE8lVe4tc2OPgPaV2Mrk868VO8jY7mmE6kdgv6vclpdnfw; atoken_expired_in=7200; client_id=o3p2-jh7itGYP6k_XMx4sLZkbkCE; capsion_ticket=2|1:0|10:1657971972|14:capsion_ticket|44:MDIxOWQ3NDA5MjNhNDAxOWI1YjdkMDI4ZTVkZGRiNDg=|9b0fc41bc765368b4bd1f48085e4a93aae67744a5c2153702710c08bc9a94973; captcha_session_v2=2|1:0|10:1657972027|18:captcha_session_v2|88:MmJ1YnpRNWMvN3NpN0FxUEhHenRaSlROVkJoQVhEM1dSNWtDMTVoRCt4eTIxbzUyS3JjbnNsVGRwSmZYTzc2Rg==|85ac3966d35dc4c337bb9b26b48d1371ce25da0604b6392cc2768108e7412a6e; z_c0=2|1:0|10:1657972052|4:z_c0|92:Mi4xdHZod0FBQUFBQUFBb0ZITTE1dEJGU2NBQUFCZ0FsVk5WREw2WWdDVWJabExwWUNmbWk0WTl4Y2tuRlpRZWxaM2hR|e78217d42f672668bac32a8b05d24db43189649d9d1d3d160549aa4b3a57b2b0; q_c1=254f23451a63411cbc5a2d5442b0137e|1657972052000|1657972052000; NOT_UNREGISTER_WAITING=1; Hm_lvt_98beee57fd2ef70ccdd5ca52b9740c49=1657960184,1657970535,1657972060; tst=h; Hm_lpvt_98beee57fd2ef70ccdd5ca52b9740c49=1657972084; SESSIONID=avjzwW4xq25qvcaz82IppXgrbpLmFtYGCXzk152kN6C; JOID=WlsTC0jrAoM7xbVYQOuCX-IYLhlbgXHnSrnpaTaRO7NEuN0yP5OsVFnFu1NFFrM0T4ZlFxqGO5omxnMknrB1H_A=; osd=UFESBkPhCII2zr9SQeaJVegZIxJRi3DqQbPjaDuaMblFtdY4NZKhX1PPul5OHLk1Qo1vHRuLMJAsx34vlLp0Evs=; KLBRSID=2177cbf908056c6654e972f5ddc96dc2|1657972097|1657971930'
-            }
-        res = requests.get(url,headers = headers).text
-        soup = BS(res,'lxml')
-        script = soup.find('script',id = "js-initialData").text
-
-        dic = {}
-        info = json.loads(script)
-        dic["title"] = info['initialState']["entities"]["questions"][qid]["title"]
-        dic["created"] = info['initialState']["entities"]["questions"][qid]["created"]
-        dic["followerCount"] = info['initialState']["entities"]["questions"][qid]["followerCount"]
-        dic["visitCount"] = info['initialState']["entities"]["questions"][qid]["visitCount"]
-        dic["answerCount"] = info['initialState']["entities"]["questions"][qid]["answerCount"]
-        dic["raw"] = info['initialState']["entities"]["questions"][qid]["detail"]
-        dic["hit_at"] = time.time()
-
-        return dic
+        url = self.settings["config"].get("base_url", "https://www.zhihu.com") + "/question/" + qid
+        res = self.fetch(url, validators)
+        if res.status_code == 304:
+            return None
+        with metrics.stage_seconds.time(stage="parse"):
+            question = self.parse_question(res.content, qid)
+        return self.question_info(question, res.headers)
 
         # Hint: - Parse JSON, which is embedded in a <script> and contains all information you need.
         #       - After find the element in soup, use `.text` attribute to get the inner text
@@ -361,6 +603,48 @@ VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
 
         raise NotImplementedError
 
+    @staticmethod
+    def question_info(question, headers) -> dict:
+        """
+        :param question: the question entity from `parse_question`
+        :param headers: the response headers, where the validators come from
+        :return: a dict of question info like `get_question`
+        """
+        dic = {}
+        dic["title"] = question["title"]
+        dic["created"] = question["created"]
+        dic["followerCount"] = question["followerCount"]
+        dic["visitCount"] = question["visitCount"]
+        dic["answerCount"] = question["answerCount"]
+        dic["raw"] = question["detail"]
+        dic["hit_at"] = time.time()
+        dic["validators"] = {
+            name: headers[header]
+            for name, header in (("If-None-Match", "ETag"), ("If-Modified-Since", "Last-Modified"))
+            if header in headers
+        }
+        return dic
+
+    @staticmethod
+    def parse_question(page: bytes, qid) -> dict:
+        """
+        Parse the question entity from the question page
+
+        :param page: the question page in bytes
+        :param qid: Question ID
+        :return: dict of the question entity in js-initialData
+        """
+        qid = str(qid)
+        question = extract_question(page, qid)
+        if question is None:  # Page layout changed, fall back to parsing the whole page
+            logger.warning(f"js-initialData fast path failed for question {qid}, parsing the whole page")
+            soup = BS(page,'lxml')
+            script = soup.find('script',id = "js-initialData").text
+            info = json.loads(script)
+            question = info['initialState']["entities"]["questions"][qid]
+        return question
+
 if __name__ == "__main__":
     z = ZhihuCrawler()
-    z.watch()
\ No newline at end of file
+    setup_logging(z.settings.get("logging"))
+    z.watch()
@@ -1,9 +1,14 @@
 import argparse
+import mmap
 import os
 import json
-import numpy as np
-from pygtrans import Translate
-from tqdm import tqdm
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+# numpy、pygtrans和tqdm导入较慢，只在需要时导入
 
 def get_parse_data():
     """解析命令行参数"""
@@ -17,6 +22,11 @@ def get_parse_data():
     parser.add_argument('-l', '--len', type=int, help="length_of_desired_range")
     parser.add_argument("-r",'--random',action="store_true",help="randomly select the words",)
     parser.add_argument("-f","--file",type=str,help="The_file_including_words_source",default="./collection.txt")
+    parser.add_argument("-d","--dictionary",type=str,help="offline_json_dictionary_used_instead_of_google_translate")
+    parser.add_argument("-w","--workers",type=int,help="concurrent_translation_requests",default=4)
+    parser.add_argument("-t","--target",type=str,help="target_language_of_the_translation",default="zh-CN")
+    parser.add_argument("-a","--all",action="store_true",help="translate_every_word_in_the_source_ahead_of_time")
+    parser.add_argument("-k","--books",type=int,help="num_of_wordbooks_to_generate",default=1)
     args = parser.parse_args()
 
     try:
@@ -25,41 +35,220 @@ def get_parse_data():
         print("You should make sure that there are more words in your desired range than the output")
         exit(1)
 
-    return args.random, args.num, args.begin, args.len, args.file
+    return args.random, args.num, args.begin, args.len, args.file, args.dictionary, args.workers, args.target, args.all, args.books
 
 def figure_out_put_name():
-    """检查输出文件夹中已有文件数量，以便为新单词本生成带编号的名称"""
-    if not os.path.exists("output"):
-        os.mkdir("output")
-        os.mkdir("output_translated")
+    """为新单词本生成带编号的名称，并在output文件夹中以独占方式创建该文件，同时运行多个程序时编号也不会重复"""
+    os.makedirs("output",exist_ok=True)
+    os.makedirs("output_translated",exist_ok=True)
     new_index=len(os.listdir("./output"))+1
-    return f"Words {new_index}.txt"
+    while True:
+        output=f"Words {new_index}.txt"
+        try:
+            os.close(os.open("./output/"+output,os.O_CREAT|os.O_EXCL|os.O_WRONLY))
+            return output
+        except FileExistsError:
+            new_index+=1
 
-def words_generator(random,n,beginning,length,filename):
-    """在第一次使用时生成一个含有所有单词翻译的隐藏json文件；按照命令行参数生成单词本，分别保存到output和output_translated文件夹"""
-    with open(filename, "r") as f:
-        words_list=f.read().split('\n')
-        words_list=[word.strip() for word in words_list if word!='']
+class RateLimiter:
+    """限制请求频率：每秒最多发出rate个请求，可在多个线程间共享"""
+    def __init__(self,rate):
+        self.interval=1/rate if rate>0 else 0
+        self.next_time=time.monotonic()
+        self.lock=threading.Lock()
 
-    dic_name=".translated.json"
-    if os.path.exists(dic_name):
-        with open(dic_name) as t:
-            dic=json.load(t)
-    else:
-        print("Initializing the dictionary...\nIt can take a while...")
-        client = Translate()
+    def acquire(self):
+        with self.lock:
+            now=time.monotonic()
+            wait=self.next_time-now
+            self.next_time=max(now,self.next_time)+self.interval
+        if wait>0:
+            time.sleep(wait)
+
+class GoogleClient:
+    """通过pygtrans调用谷歌翻译；translate接收一批单词，返回等长的译文列表"""
+    def __init__(self,target):
+        from pygtrans import Translate
+        self.client=Translate(target=target,fmt="text")
+
+    def translate(self,words):
+        result=self.client.translate(words)
+        if not isinstance(result,list):
+            raise RuntimeError(f"Translation failed: {result}")
+        return [each.translatedText for each in result]
+
+class DictClient:
+    """离线词典，与GoogleClient接口相同，可在无法访问谷歌翻译时或测试时代替它；词典中没有的单词返回None"""
+    def __init__(self,filename):
+        with open(filename,encoding="utf8") as f:
+            self.dic=json.load(f)
+
+    def translate(self,words):
+        return [self.dic.get(word) for word in words]
+
+def translate_words(words,client,batch_size=50,workers=4,rate=2,retries=2):
+    """把单词分批，在限速下并发翻译；返回{单词: 译文}，只含翻译成功的单词，失败的单词留到下次运行时重试"""
+    limiter=RateLimiter(rate)
+    batches=[words[i:i+batch_size] for i in range(0,len(words),batch_size)]
+
+    def translate_batch(batch):
+        for attempt in range(retries+1):
+            limiter.acquire()
+            try:
+                translated=client.translate(batch)
+                return {word:trans for word,trans in zip(batch,translated) if trans}
+            except Exception as e:
+                error=e
+                if attempt<retries:  # 最后一次失败后不再等待
+                    time.sleep(2**attempt)
+        print(f"{len(batch)} words failed: {error}")
+        return {}
+
+    from tqdm import tqdm
+    dic={}
+    with ThreadPoolExecutor(max(1,workers)) as executor:
+        for translated in tqdm(executor.map(translate_batch,batches),total=len(batches)):
+            dic.update(translated)
+    return dic
+
+class TranslationStore:
+    """保存在SQLite文件中的翻译库，以(单词, 目标语言)为键，所有词汇来源共用；只保存翻译成功的单词"""
+    def __init__(self,path=".translations.db",target="zh-CN",legacy=".translated.json"):
+        self.target=target
+        new=not os.path.exists(path)
+        self.db=sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS translation "
+                        "(word TEXT NOT NULL, target TEXT NOT NULL, translated TEXT NOT NULL, "
+                        "PRIMARY KEY (word, target)) WITHOUT ROWID")
+        if new and legacy and os.path.exists(legacy):
+            self.import_json(legacy)
+
+    def lookup(self,words):
+        """返回{单词: 译文}，只含库中已有的单词"""
+        words=list(words)
         dic={}
-        for each in tqdm(words_list):
-            words=each.split(',')
-            for word in words:
-                try:
-                    inChinese=client.translate(word).translatedText
-                    dic[word]=inChinese
-                except:
-                    dic[word]="翻译失败"
-        with open(dic_name,'w') as t:
-            json.dump(dic,t)
-        print("Finished the dictionary.")
+        for i in range(0,len(words),500):  # SQLite限制一条语句中的参数个数
+            chunk=words[i:i+500]
+            dic.update(self.db.execute(
+                f"SELECT word, translated FROM translation WHERE target=? AND word IN ({','.join('?'*len(chunk))})",
+                [self.target,*chunk]))
+        return dic
+
+    def missing(self,words):
+        """返回尚未翻译的单词，保持原有顺序"""
+        found=self.lookup(words)
+        return [word for word in words if word not in found]
+
+    def save(self,dic):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO translation VALUES (?, ?, ?)",
+                                ((word,self.target,trans) for word,trans in dic.items()))
+
+    def import_json(self,filename):
+        """导入旧版本的.translated.json（其中是中文译文），跳过翻译失败的单词"""
+        with open(filename) as t:
+            dic=json.load(t)
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO translation VALUES (?, 'zh-CN', ?)",
+                                ((word,trans) for word,trans in dic.items() if trans!="翻译失败"))
+
+    def close(self):
+        self.db.close()
+
+INDEX_MAGIC=b"WBIDX2\0\0"  # 索引格式改变时更换，旧格式的索引会被重建
+
+class WordSource:
+    """词汇来源文件，按行号读取其中的非空行；
+    行偏移索引保存在来源文件旁的“<来源文件>.idx”中，来源文件的修改时间或大小改变时重建，
+    单词通过mmap按偏移读取，读取n个单词的开销与来源文件的大小无关"""
+    def __init__(self,filename):
+        with open(filename,"rb") as f:
+            stat=os.fstat(f.fileno())
+            self.mm=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) if stat.st_size else b""
+        self.index=self.load_index(filename+".idx",stat)
+
+    def load_index(self,index_name,stat):
+        """索引文件以8字节的格式标记开头，其后为小端序的int64：前两项为来源文件的修改时间和大小，其后为每个非空行的起始偏移；
+        与文本模式读取时相同，行尾的\\r不算作行的内容，只有\\r的行也是空行"""
+        version=struct.pack("<8sqq",INDEX_MAGIC,stat.st_mtime_ns,stat.st_size)
+        if os.path.exists(index_name) and os.path.getsize(index_name)>=len(version):
+            with open(index_name,"rb") as f:
+                if f.read(len(version))==version:
+                    return mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        import numpy as np
+        buffer=np.frombuffer(self.mm,dtype=np.uint8)
+        newlines=np.flatnonzero(buffer==ord('\n'))
+        starts=np.concatenate([[0],newlines+1])
+        ends=np.concatenate([newlines,[len(buffer)]])
+        nonempty=ends>starts
+        ends[nonempty]-=buffer[ends[nonempty]-1]==ord('\r')  # \r\n换行
+        index=version+starts[ends>starts].astype("<i8").tobytes()
+        try:
+            # 每个进程写入自己的临时文件再替换，同时运行的程序不会读到写了一半的索引
+            fd,tmp=tempfile.mkstemp(prefix=os.path.basename(index_name)+".",dir=os.path.dirname(os.path.abspath(index_name)))
+            try:
+                with os.fdopen(fd,"wb") as f:
+                    f.write(index)
+                os.replace(tmp,index_name)
+            except OSError:
+                os.unlink(tmp)
+                raise
+        except OSError:  # 来源文件所在的文件夹不可写时，只在内存中使用索引
+            pass
+        return index
+
+    def __len__(self):
+        return len(self.index)//8-3
+
+    def __getitem__(self,i):
+        if not 0<=i<len(self):
+            raise IndexError(i)
+        start=struct.unpack_from("<q",self.index,24+8*i)[0]
+        end=self.mm.find(b"\n",start)
+        return self.mm[start:end if end>=0 else len(self.mm)].decode("utf8").strip()
+
+    def lines(self):
+        """按顺序返回所有非空行"""
+        return [line.strip() for line in bytes(self.mm).decode("utf8").split("\n") if line.rstrip("\r")!=""]
+
+    def close(self):
+        for each in (self.mm,self.index):
+            if isinstance(each,mmap.mmap):
+                each.close()
+
+def split_words(items):
+    """把词汇来源中的行拆分为单词，去掉重复的单词"""
+    return list(dict.fromkeys(word for each in items for word in each.split(',')))
+
+def fill_store(store,words,client,workers):
+    """翻译库中还没有的单词并保存；返回新翻译的{单词: 译文}"""
+    missing=store.missing(words)
+    if not missing:
+        return {}
+    print(f"Translating {len(missing)} words...")
+    translated=translate_words(missing,client or GoogleClient(store.target),workers=workers)
+    store.save(translated)
+    if len(translated)<len(missing):
+        print(f"{len(missing)-len(translated)} words failed and will be retried next time.")
+    return translated
+
+def choose_offsets(random,n,length,books):
+    """为每本单词本选出n个待选范围内的偏移（从0开始）；随机选取时各本分别不放回地抽取，开销与n成正比，与待选范围的大小无关"""
+    if not random:
+        return [range(n)]*books
+    from random import sample
+    return [sample(range(length),n) for _ in range(books)]
+
+def words_generator(random,n,beginning,length,filename,client=None,workers=4,store=None,translate_all=False,books=1):
+    """按照命令行参数生成books本单词本，分别保存到output和output_translated文件夹；
+    只翻译选中的单词中翻译库里还没有的，使用-a时先翻译词汇来源中所有还没有翻译的单词"""
+    words_list=WordSource(filename)
+
+    if store is None:
+        store=TranslationStore()
+    if translate_all:
+        print("It can take a while...")
+        fill_store(store,split_words(words_list.lines()),client,workers)
 
     try:
         assert len(words_list)>=length+beginning-1
@@ -67,32 +256,30 @@ def words_generator(random,n,beginning,length,filename):
         print("There aren't enough words!")
         exit(1)
 
-    output=figure_out_put_name()
-    print(f"Generating {output}...")
-    out_trans="./output_translated/"+output
-    out="./output/"+output
-    
-    if not random:
-        choices=range(n)
-    else:
-        rng=np.random.default_rng()
-        choices=rng.choice(range(length),n,replace=False)
-
-    with open(out,'w') as f:
-        with open(out_trans,'w') as ft:
-            for i,offset in enumerate(tqdm(choices)):
-                ft.write(f"{i+1}: ")
-                f.write(f"{i+1}: ")
-                index=beginning+offset-1
-                item=words_list[index]
-                ft.write(f"{item}  :  ")
-                f.write(item)
-                f.write('\n')
-                words=item.split(',')
-                for word in words:
-                    ft.write(f"{dic[word]}, ")
-                ft.write('\n')
+    selections=[[words_list[beginning+offset-1] for offset in offsets]
+                for offsets in choose_offsets(random,n,length,books)]
+    words_list.close()
+    words=split_words(item for items in selections for item in items)
+    dic=store.lookup(words)
+    if len(dic)<len(words) and not translate_all:  # 使用-a时刚刚已经尝试过
+        dic.update(fill_store(store,words,client,workers))
+
+    for items in selections:
+        output=figure_out_put_name()
+        print(f"Generating {output}...")
+        # 整本拼接好后一次写入
+        with open("./output/"+output,'w') as f:
+            f.write("".join(f"{i+1}: {item}\n" for i,item in enumerate(items)))
+        with open("./output_translated/"+output,'w') as ft:
+            ft.write("".join(
+                f"{i+1}: {item}  :  "+"".join(f"{dic.get(word,'翻译失败')}, " for word in item.split(','))+"\n"
+                for i,item in enumerate(items)))
 
     print("Finished!")
-       
-words_generator(*get_parse_data())
\ No newline at end of file
+
+if __name__=="__main__":
+    random,n,beginning,length,filename,dictionary,workers,target,translate_all,books=get_parse_data()
+    store=TranslationStore(target=target)
+    words_generator(random,n,beginning,length,filename,DictClient(dictionary) if dictionary else None,
+                    workers,store,translate_all,books)
+    store.close()